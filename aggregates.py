@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import coffeeScore
+import cupcomp
+import statTest
+from loader import load_survey, SUBMISSION_ID, AGE_ORDER
+from statTest import new_counts, label_codes, add_pairs
+from profiling import profiled
+
+# Running aggregates live in a state directory: the aggregates themselves in a small JSON file whose
+# size does not depend on the number of respondents, and the Submission IDs already counted in sorted
+# segments under SEEN_DIR. An update writes its own IDs as a new segment and segments of similar size are
+# merged, so there are O(log n) segments and looking a batch up never reads the whole history.
+STATE_FILE = "aggregates.json"
+SEEN_DIR = "seen"
+
+# Text file of the IDs kept by earlier versions, converted to a segment on first load
+SEEN_FILE = "seen_ids.txt"
+
+COLUMNS = list(dict.fromkeys([SUBMISSION_ID] + statTest.COLUMNS + coffeeScore.COLUMNS + cupcomp.COLUMNS))
+
+
+def new_state():
+    return {
+        "n_seen": 0,
+        # Segment files holding the counted Submission IDs, oldest first
+        "seen_segments": [],
+        "seen_counter": 0,
+        "tables": statTest.new_table_counts(),
+        # Combined Score histograms: group -> score value -> respondents
+        "age_scores": new_counts(AGE_ORDER),
+        "cup_scores": new_counts(),
+        # Combined Score count, sum and sum of squares per group
+        "age_moments": {"rows": list(AGE_ORDER), "values": np.zeros((len(AGE_ORDER), 3))},
+        "cup_moments": {"rows": [], "values": np.zeros((0, 3))},
+    }
+
+
+def add_moments(moments, groups, scores):
+    codes = label_codes(moments["rows"], groups)
+    n_groups = len(moments["rows"])
+    if moments["values"].shape[0] != n_groups:
+        grown = np.zeros((n_groups, 3))
+        grown[:moments["values"].shape[0]] = moments["values"]
+        moments["values"] = grown
+    scores = np.asarray(scores, dtype=np.float64)
+    moments["values"][:, 0] += np.bincount(codes, minlength=n_groups)
+    moments["values"][:, 1] += np.bincount(codes, weights=scores, minlength=n_groups)
+    moments["values"][:, 2] += np.bincount(codes, weights=scores * scores, minlength=n_groups)
+
+
+def encode_ids(ids):
+    # Sorted, distinct Submission IDs as fixed-width bytes, the layout of a segment
+    return np.unique(np.array([str(submission_id).encode("utf-8") for submission_id in ids], dtype=np.bytes_))
+
+
+def write_segment(state_dir, name, ids):
+    os.makedirs(os.path.join(state_dir, SEEN_DIR), exist_ok=True)
+    path = os.path.join(state_dir, SEEN_DIR, name)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, ids)
+    os.replace(tmp_path, path)
+
+
+def read_segment(state_dir, name):
+    # Memory-mapped, so a lookup only touches the pages its binary searches visit
+    return np.load(os.path.join(state_dir, SEEN_DIR, name), mmap_mode="r")
+
+
+def is_seen(segments, ids):
+    # Whether each ID is in one of the sorted segments, by binary search
+    ids = np.array([str(submission_id).encode("utf-8") for submission_id in ids], dtype=np.bytes_)
+    found = np.zeros(len(ids), dtype=bool)
+    for segment in segments:
+        if len(segment) == 0:
+            continue
+        positions = np.minimum(np.searchsorted(segment, ids), len(segment) - 1)
+        found |= segment[positions] == ids
+    return found
+
+
+def load_state(state_dir):
+    state_path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return new_state(), []
+
+    with open(state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    for counts in list(state["tables"].values()) + [state["age_scores"], state["cup_scores"]]:
+        counts["counts"] = np.array(counts["counts"], dtype=np.int64).reshape(len(counts["rows"]), len(counts["columns"]))
+    for moments in (state["age_moments"], state["cup_moments"]):
+        moments["values"] = np.array(moments["values"], dtype=np.float64).reshape(len(moments["rows"]), 3)
+
+    seen_path = os.path.join(state_dir, SEEN_FILE)
+    if "seen_segments" not in state:
+        # The text file may end with IDs of an update interrupted before its aggregates were saved
+        with open(seen_path, encoding="utf-8") as f:
+            seen_ids = f.read().splitlines()[:state["n_seen"]]
+        state["seen_segments"], state["seen_counter"] = ["0.npy"], 1
+        write_segment(state_dir, "0.npy", encode_ids(seen_ids))
+        save_state(state_dir, state)
+        os.remove(seen_path)
+
+    # Segments not listed in the state belong to an interrupted update and are ignored (and later overwritten)
+    return state, [read_segment(state_dir, name) for name in state["seen_segments"]]
+
+
+def add_segment(state_dir, state, new_ids):
+    # Write the new IDs as a segment, merging it with the previous one while that is at most twice its size.
+    # Each ID is rewritten O(log n) times in total, like the carries of a binary counter.
+    segments = list(state["seen_segments"])
+    counter = state["seen_counter"]
+    merged = encode_ids(new_ids)
+    while segments and 2 * len(merged) >= len(read_segment(state_dir, segments[-1])):
+        merged = np.union1d(read_segment(state_dir, segments.pop()), merged)
+    write_segment(state_dir, f"{counter}.npy", merged)
+    obsolete = [name for name in state["seen_segments"] if name not in segments]
+    state["seen_segments"] = segments + [f"{counter}.npy"]
+    state["seen_counter"] = counter + 1
+    return obsolete
+
+
+def save_state(state_dir, state, new_ids=()):
+    # The new IDs are written first, the state file lists the segments that were counted
+    os.makedirs(state_dir, exist_ok=True)
+    obsolete = add_segment(state_dir, state, new_ids) if len(new_ids) else []
+
+    serialised = json.loads(json.dumps(state, default=lambda value: value.tolist()))
+    tmp_path = os.path.join(state_dir, STATE_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(serialised, f)
+    os.replace(tmp_path, os.path.join(state_dir, STATE_FILE))
+
+    # Merged segments are only deleted once the state no longer lists them
+    for name in obsolete:
+        os.remove(os.path.join(state_dir, SEEN_DIR, name))
+
+
+@profiled("aggregates.update")
+def update(state, seen, batch):
+    # Add a batch of responses, skipping Submission IDs that were already counted
+    batch = batch.dropna(subset=[SUBMISSION_ID]).drop_duplicates(subset=[SUBMISSION_ID])
+    batch = batch[~is_seen(seen, batch[SUBMISSION_ID].astype(str).tolist())]
+    new_ids = batch[SUBMISSION_ID].astype(str).tolist()
+
+    statTest.add_chunk(state["tables"], batch)
+
+    by_age = coffeeScore.score_by_age(batch)
+    add_pairs(state["age_scores"], by_age["Age Group"].astype(str), by_age["Combined Score"])
+    add_moments(state["age_moments"], by_age["Age Group"].astype(str), by_age["Combined Score"])
+
+    by_cups = cupcomp.score_by_cups(batch)
+    add_pairs(state["cup_scores"], by_cups["Cups Per Day"], by_cups["Combined Score"])
+    add_moments(state["cup_moments"], by_cups["Cups Per Day"], by_cups["Combined Score"])
+
+    seen.append(encode_ids(new_ids))
+    state["n_seen"] += len(new_ids)
+    return new_ids
+
+
+def moments_table(moments, name):
+    count, total, total_sq = moments["values"].T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean * mean, 0) * count / (count - 1))
+    table = pd.DataFrame({"Respondents": count.astype(np.int64), "Mean Score": mean, "Std": std},
+                         index=pd.Index(moments["rows"], name=name))
+    return table[table["Respondents"] > 0]
+
+
+@profiled("aggregates.report")
+def report(state, output_dir="."):
+    tables = statTest.finish_tables(state["tables"])
+    statTest.report(tables)
+    statTest.plot_all(tables, output_dir)
+
+    # The score histograms are drawn directly, so rendering does not depend on the number of respondents
+    age_scores = state["age_scores"]
+    coffeeScore.plot_score_counts(age_scores["rows"], age_scores["columns"], age_scores["counts"],
+                                  os.path.join(output_dir, "Coffee_Score"))
+
+    cup_scores = state["cup_scores"]
+    cupcomp.plot_cup_counts(cup_scores["rows"], cup_scores["columns"], cup_scores["counts"],
+                            os.path.join(output_dir, "Cup_Comparison.png"))
+
+    print("Combined Score by Age Group:")
+    print(moments_table(state["age_moments"], "Age Group"))
+    print("Combined Score by Cups Per Day:")
+    print(moments_table(state["cup_moments"], "Cups Per Day").sort_index())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep running aggregates of the survey and report from them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    update_parser = subparsers.add_parser("update", help="add a batch of new responses")
+    update_parser.add_argument("state_dir", help="directory holding the aggregate state")
+    update_parser.add_argument("file_path", help="CSV with the new responses")
+
+    report_parser = subparsers.add_parser("report", help="regenerate the reports from the aggregates")
+    report_parser.add_argument("state_dir", help="directory holding the aggregate state")
+    report_parser.add_argument("--output-dir", default=".", help="directory the figures are written to")
+    args = parser.parse_args()
+
+    state, seen = load_state(args.state_dir)
+    if args.command == "update":
+        try:
+            batch = load_survey(args.file_path, COLUMNS)
+        except FileNotFoundError:
+            print(f"Error: File not found at {args.file_path}")
+            sys.exit(1)
+        new_ids = update(state, seen, batch)
+        save_state(args.state_dir, state, new_ids)
+        print(f"Added {len(new_ids)} new responses ({len(batch) - len(new_ids)} already counted), "
+              f"{state['n_seen']} in total")
+    else:
+        if state["n_seen"] == 0:
+            print(f"Error: No responses have been added to {args.state_dir}")
+            sys.exit(1)
+        os.makedirs(args.output_dir, exist_ok=True)
+        report(state, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+from functools import lru_cache
+import pandas as pd
+from loader import CACHE_DIR
+from profiling import profiled
+
+# Artifacts are stored next to the survey snapshots, one directory per key: <cache>/<key[:2]>/<key>/
+ARTIFACT_DIR = "artifacts"
+VALUE_FILE = "value.pkl"
+
+# Least recently used entries are evicted once the cache holds more than this many bytes
+MAX_BYTES = 1024 * 1024 * 1024
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def default_cache_dir(file_path):
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR, ARTIFACT_DIR)
+
+
+def local_modules(module, found=None):
+    # The module and every project module it uses, directly or through other project modules
+    found = {} if found is None else found
+    path = getattr(module, "__file__", None)
+    if path is None or os.path.dirname(os.path.abspath(path)) != PROJECT_DIR or module.__name__ in found:
+        return found
+    found[module.__name__] = path
+    for value in list(vars(module).values()):
+        used = value if inspect.ismodule(value) else sys.modules.get(getattr(value, "__module__", None) or "")
+        if used is not None:
+            local_modules(used, found)
+    return found
+
+
+@lru_cache(maxsize=None)
+def code_hash(module_name):
+    # Code version of a module: the source of every project module it depends on
+    digest = hashlib.sha1()
+    for name, path in sorted(local_modules(sys.modules[module_name]).items()):
+        digest.update(name.encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+@profiled("artifacts.data_hash")
+def data_hash(data, columns=None):
+    # Content hash of the columns an analysis reads: names, dtypes (with the category order) and values
+    frame = data if columns is None else data[list(columns)]
+    digest = hashlib.sha1(json.dumps([[column, repr(frame[column].dtype)] for column in frame.columns]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def artifact_key(name, function, inputs=(), params=None):
+    # Content address of an artifact: what it is, the code computing it, the keys of its inputs and its
+    # parameters (scoring dictionaries included). Any change to one of them gives a new key.
+    description = {"name": name, "code": code_hash(function.__module__), "inputs": list(inputs),
+                   "params": params or {}}
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def entry_dir(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def lookup(cache_dir, key):
+    # Entry directory of a key, None if it is not cached; a hit counts as a use for the eviction order
+    path = entry_dir(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+    os.utime(path)
+    return path
+
+
+@profiled("artifacts.load")
+def load_value(cache_dir, key):
+    # The cached result of a stage, None if it is not cached
+    path = lookup(cache_dir, key)
+    if path is None or not os.path.exists(os.path.join(path, VALUE_FILE)):
+        return None
+    with open(os.path.join(path, VALUE_FILE), "rb") as f:
+        return pickle.load(f)
+
+
+def restore_file(cache_dir, key, output):
+    # Copy a cached output file into place, False if it is not cached
+    path = lookup(cache_dir, key)
+    cached = None if path is None else os.path.join(path, os.path.basename(output))
+    if cached is None or not os.path.exists(cached):
+        return False
+    tmp_path = output + ".tmp"
+    shutil.copyfile(cached, tmp_path)
+    os.replace(tmp_path, output)
+    return True
+
+
+@profiled("artifacts.store")
+def store(cache_dir, key, value=None, files=(), max_bytes=MAX_BYTES):
+    # An entry holds a pickled value and/or copies of output files. It is written under a temporary name and
+    # renamed into place, so readers never see half an entry; if another run stored the key first, that one stays.
+    path = entry_dir(cache_dir, key)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    if value is not None:
+        with open(os.path.join(tmp_path, VALUE_FILE), "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    for output in files:
+        shutil.copyfile(output, os.path.join(tmp_path, os.path.basename(output)))
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict(cache_dir, max_bytes)
+
+
+def entries(cache_dir):
+    # (last use, bytes, path) of every complete entry
+    found = []
+    if not os.path.isdir(cache_dir):
+        return found
+    for shard in os.scandir(cache_dir):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.is_dir() and ".tmp-" not in entry.name:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                found.append((entry.stat().st_mtime, size, entry.path))
+    return found
+
+
+def evict(cache_dir, max_bytes=MAX_BYTES):
+    # Remove the least recently used entries until the cache fits in max_bytes
+    cached = sorted(entries(cache_dir))
+    total = sum(size for _, size, _ in cached)
+    for _, size, path in cached:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
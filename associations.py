@@ -0,0 +1,196 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from loader import load_survey, SUBMISSION_ID, FREE_TEXT_COLUMNS
+from multiselect import MULTISELECT_GROUPS
+from profiling import profiled
+from weighting import survey_weights
+
+# Questions with more distinct answers than this are left out
+MAX_LEVELS = 20
+
+
+def question_levels(series):
+    # Integer answer codes (-1 for no answer) and the answer labels of one question
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(dtype=np.int64), list(series.cat.categories)
+    if series.dtype == "boolean":
+        return series.astype("Int8").fillna(-1).to_numpy(dtype=np.int64), [False, True]
+    values = series.to_numpy(dtype=np.float64)
+    levels, codes = np.unique(values, return_inverse=True)
+    codes = codes.ravel()
+    answered = ~np.isnan(levels)
+    codes[~answered[codes]] = -1
+    return codes, list(levels[answered])
+
+
+def questions(data, max_levels=MAX_LEVELS):
+    # Every categorical and checkbox question with 2 to max_levels observed answers. Free text, IDs and the
+    # joined multi-select answers (their checkbox columns are used instead) are left out.
+    skipped = {SUBMISSION_ID, *FREE_TEXT_COLUMNS, *MULTISELECT_GROUPS.values()}
+    encoded = {}
+    for column in data.columns:
+        if column in skipped:
+            continue
+        codes, levels = question_levels(data[column])
+        observed = np.bincount(codes[codes >= 0], minlength=len(levels)) > 0
+        if 2 <= observed.sum() <= max_levels:
+            encoded[column] = (codes, levels)
+    return encoded
+
+
+def one_hot(encoded, n_rows):
+    # Sparse (respondents x answers) 0/1 matrix with one block of columns per question, and the
+    # (answers x questions) indicator of which question each answer column belongs to
+    rows, columns, owners, offset = [], [], [], 0
+    for question, (codes, levels) in enumerate(encoded.values()):
+        answered = np.flatnonzero(codes >= 0)
+        rows.append(answered)
+        columns.append(offset + codes[answered])
+        owners.append(np.full(len(levels), question))
+        offset += len(levels)
+    rows, columns, owners = np.concatenate(rows), np.concatenate(columns), np.concatenate(owners)
+    X = sp.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(n_rows, offset))
+    G = sp.csr_matrix((np.ones(offset), (np.arange(offset), owners)), shape=(offset, len(encoded)))
+    return X, G
+
+
+def benjamini_hochberg(p_values):
+    # False discovery rate adjusted p-values (q-values); NaN stays NaN
+    p_values = np.asarray(p_values, dtype=np.float64)
+    q_values = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    order = valid[np.argsort(p_values[valid])]
+    ranked = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return q_values
+
+
+@profiled("associations.pairs")
+def association_matrix(X, G, weights=None):
+    # Pearson chi-square, degrees of freedom and Cramer's V of every pair of questions at once.
+    # C = X'X holds every pairwise contingency table as a block; each pair uses the respondents who
+    # answered both questions, and its margins come from C G (answer counts against each other question).
+    # With survey weights C = X'WX sums the respondents' weights instead of counting them.
+    C = (X.T @ X if weights is None else X.T @ sp.diags(weights) @ X).toarray()
+    G = G.toarray()
+    margins = C @ G
+    n = G.T @ C @ G
+
+    # Chi-square = N * sum(O^2 / (row total * column total)) - N, summed block by block
+    expected = (margins @ G.T) * (margins @ G.T).T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratios = np.where(expected > 0, C ** 2 / expected, 0)
+    statistic = n * (G.T @ ratios @ G) - n
+
+    # Answers never given together with the other question do not count as table rows or columns
+    levels = G.T @ (margins > 0)
+    dof = (levels - 1) * (levels - 1).T
+    # A pair without a table (dof 0) has no Cramer's V, even when rounding leaves its statistic a hair above 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cramers_v = np.sqrt(np.maximum(statistic, 0) / (n * np.minimum(levels - 1, (levels - 1).T)))
+    cramers_v[dof == 0] = np.nan
+    return n, statistic, dof, cramers_v
+
+
+def pair_design_effects(X, G, weights):
+    # Design effect of the weights over the respondents who answered both questions of each pair, as in
+    # weighting.table_design_effect: sum(w^2) / sum(w) per pair, with the respondent counts of every pair
+    answered = (X @ G).tocsr()
+    answered.data[:] = 1
+    respondents = (answered.T @ answered).toarray()
+    totals = (answered.T @ sp.diags(weights) @ answered).toarray()
+    squares = (answered.T @ sp.diags(weights ** 2) @ answered).toarray()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return respondents, squares / totals
+
+
+def association_table(encoded, n, statistic, dof, cramers_v, design_effects=None):
+    # One row per pair of questions, strongest association first. n is the respondents of every pair;
+    # weighted statistics are divided by the pair's design effect before the p-value (Rao-Scott).
+    from scipy.stats import chi2
+    names = list(encoded)
+    first, second = np.triu_indices(len(names), k=1)
+    valid = dof[first, second] > 0
+    first, second = first[valid], second[valid]
+
+    corrected = statistic if design_effects is None else statistic / design_effects
+    p_values = chi2.sf(corrected[first, second], dof[first, second])
+    table = pd.DataFrame({
+        "Question A": np.asarray(names, dtype=object)[first],
+        "Question B": np.asarray(names, dtype=object)[second],
+        "Respondents": n[first, second].astype(np.int64),
+        "Chi2": corrected[first, second],
+        "DOF": dof[first, second].astype(np.int64),
+        "p-value": p_values,
+        "q-value": benjamini_hochberg(p_values),
+        "Cramer's V": cramers_v[first, second],
+    })
+    return table.sort_values(["Cramer's V", "p-value"], ascending=[False, True], ignore_index=True)
+
+
+def short_label(question, width=45):
+    # Checkbox columns are shown as "<group>: <option>" so the option survives the truncation
+    for group, parent in MULTISELECT_GROUPS.items():
+        if question.startswith(parent + " ("):
+            question = f"{group}: {question[len(parent) + 2:-1]}"
+    return question if len(question) <= width else question[:width - 3] + "..."
+
+
+def plot_clustermap(encoded, cramers_v, output="association_clustermap.png"):
+    # Questions reordered by hierarchical clustering of their Cramer's V profiles
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    labels = [short_label(question) for question in encoded]
+    values = np.nan_to_num(cramers_v)
+    np.fill_diagonal(values, 1)
+    matrix = pd.DataFrame(values, index=labels, columns=labels)
+    size = max(12, 0.22 * len(labels))
+    grid = sns.clustermap(matrix, cmap="YlGnBu", vmin=0, vmax=1, figsize=(size, size),
+                          xticklabels=True, yticklabels=True, cbar_kws={"label": "Cramer's V"})
+    grid.ax_heatmap.tick_params(labelsize=6)
+    grid.savefig(output, dpi=300)
+    plt.close(grid.fig)
+
+
+def associations(data, max_levels=MAX_LEVELS, weights=None):
+    encoded = questions(data, max_levels)
+    X, G = one_hot(encoded, len(data))
+    n, statistic, dof, cramers_v = association_matrix(X, G, weights)
+    design_effects = None
+    if weights is not None:
+        n, design_effects = pair_design_effects(X, G, np.asarray(weights, dtype=np.float64))
+    return encoded, association_table(encoded, n, statistic, dof, cramers_v, design_effects), cramers_v
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chi-square and Cramer's V between every pair of questions")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--max-levels", type=int, default=MAX_LEVELS, help="skip questions with more answers")
+    parser.add_argument("--output", default="associations.csv", help="ranked table of every pair")
+    parser.add_argument("--heatmap", default="association_clustermap.png", help="clustered Cramer's V heatmap")
+    parser.add_argument("--top", type=int, default=20, help="pairs printed")
+    parser.add_argument("--unweighted", action="store_true", help="count every respondent equally")
+    args = parser.parse_args()
+
+    try:
+        data = load_survey(args.file_path)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    weights = None if args.unweighted else survey_weights(data)
+    encoded, table, cramers_v = associations(data, args.max_levels, weights)
+    table.to_csv(args.output, index=False)
+    plot_clustermap(encoded, cramers_v, args.heatmap)
+
+    significant = (table["q-value"] < 0.05).sum()
+    print(f"{len(encoded)} questions, {len(table)} pairs, {significant} significant at FDR 5%")
+    top = table.head(args.top).copy()
+    top[["Question A", "Question B"]] = top[["Question A", "Question B"]].map(short_label)
+    print(top.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import coffeeScore
+import cupcomp
+import demographics
+import machinelearningRF
+import statTest
+import weighting
+from loader import load_survey
+from pipeline import COLUMNS
+from synthetic import generate, GENERATOR_VERSION
+
+# The default run stays at a size that takes minutes. The full scale run (--full) ends at 10 million respondents,
+# a synthetic CSV of about 7 GB that takes hours to generate, load and analyse.
+SIZES = [4000, 40000, 400000]
+FULL_SIZES = SIZES + [4000000, 10000000]
+
+# Stage name -> (function run on the previous results, result it needs, name of the result it stores or None).
+# Stages run in this order at every size.
+STAGES = {
+    "load.csv": (lambda r: load_survey(r["file_path"], COLUMNS, r["cache_dir"]), None, "data"),
+    "load.snapshot": (lambda r: load_survey(r["file_path"], COLUMNS, r["cache_dir"]), "data", "data"),
+    "weighting.weights": (lambda r: weighting.survey_weights(r["data"]), "data", "weights"),
+    "coffeeScore.score": (lambda r: coffeeScore.score_by_age(r["data"], r["weights"]), "weights", "scores_by_age"),
+    "coffeeScore.render": (lambda r: coffeeScore.plot_scores(r["scores_by_age"], r["output"]), "scores_by_age", None),
+    "cupcomp.score": (lambda r: cupcomp.score_by_cups(r["data"], r["weights"]), "weights", "scores_by_cups"),
+    "cupcomp.render": (lambda r: cupcomp.plot_cups(r["scores_by_cups"], r["output"]), "scores_by_cups", None),
+    "demographics.render": (lambda r: demographics.plot_age_distribution(r["data"], r["output"]), "data", None),
+    "statTest.tables": (lambda r: statTest.build_tables(r["data"], r["weights"]), "weights", "stat_tables"),
+    "statTest.chi2": (lambda r: statTest.report(r["stat_tables"]), "stat_tables", None),
+    "statTest.render": (lambda r: statTest.plot_all(r["stat_tables"], r["output_dir"]), "stat_tables", None),
+    "machinelearningRF.train": (lambda r: machinelearningRF.train_model(r["data"]), "data", "rf_model"),
+    "machinelearningRF.render": (lambda r: machinelearningRF.plot_predictions(r["rf_model"], r["output"]),
+                                 "rf_model", None),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def synthetic_file(file_path, data_dir, rows, seed):
+    # Generated once per (size, seed) and reused by later runs
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_{rows}_{seed}_v{GENERATOR_VERSION}.csv")
+    if not os.path.exists(path):
+        generate(file_path, path, rows, seed)
+    return path
+
+
+def required_stages(stages):
+    # The selected stages plus every stage producing a result they need, in run order
+    required = set(stages)
+    for name in reversed(list(STAGES)):
+        needs = STAGES[name][1]
+        if name in required and needs is not None:
+            required.update(other for other, (_, _, key) in STAGES.items()
+                            if key == needs and list(STAGES).index(other) < list(STAGES).index(name))
+    return [name for name in STAGES if name in required]
+
+
+def time_stages(file_path, stages, repeat):
+    # Every repeat starts from an empty snapshot cache, so "load.csv" always parses the CSV
+    timings = {name: [] for name in stages}
+    run_stages = required_stages(stages)
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = {
+                "file_path": file_path,
+                "cache_dir": os.path.join(work_dir, "cache"),
+                "output_dir": work_dir,
+                "output": os.path.join(work_dir, "figure.png"),
+            }
+            for name in run_stages:
+                function, _, key = STAGES[name]
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = function(results)
+                elapsed = time.perf_counter() - start
+                if key is not None:
+                    results[key] = result
+                if name in timings:
+                    timings[name].append(elapsed)
+    return timings
+
+
+def run(file_path, sizes, stages, repeat=3, seed=0, data_dir=os.path.join("benchmarks", "data")):
+    results = []
+    for rows in sizes:
+        path = synthetic_file(file_path, data_dir, rows, seed)
+        for name, seconds in time_stages(path, stages, repeat).items():
+            results.append({"stage": name, "rows": rows, "seconds": seconds, "median": float(np.median(seconds))})
+            print(f"{rows:>10} {name:<26} {np.median(seconds):10.3f}s")
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(old_path, new_path, threshold=1.2, noise=0.01):
+    # Median time of every (stage, rows) present in both runs. Slower by more than the threshold is flagged,
+    # unless the difference is under the noise floor in seconds.
+    with open(old_path) as f:
+        old = {(r["stage"], r["rows"]): r["median"] for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {(r["stage"], r["rows"]): r["median"] for r in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"{'rows':>10} {'stage':<26} {'old':>10} {'new':>10} {'ratio':>7}")
+    for stage, rows in sorted(old.keys() & new.keys(), key=lambda key: (key[1], list(STAGES).index(key[0]))):
+        ratio = new[stage, rows] / old[stage, rows] if old[stage, rows] else float("inf")
+        flag = "  slower" if ratio > threshold and new[stage, rows] - old[stage, rows] > noise else ""
+        regressions += bool(flag)
+        print(f"{rows:>10} {stage:<26} {old[stage, rows]:9.3f}s {new[stage, rows]:9.3f}s {ratio:7.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every analysis stage on synthetic surveys of several sizes")
+    parser.add_argument("file_path", nargs="?", default="GACTT_RESULTS_ANONYMIZED_v2.csv",
+                        help="the real survey CSV the synthetic data is generated from")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of synthetic respondents")
+    parser.add_argument("--full", action="store_true", help="run every size up to 10 million respondents")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="stages to time")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the median is reported")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--data-dir", default=os.path.join("benchmarks", "data"), help="where synthetic CSVs are kept")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        try:
+            regressions = compare(*args.compare)
+        except FileNotFoundError as error:
+            print(f"Error: File not found at {error.filename}")
+            sys.exit(1)
+        sys.exit(1 if regressions else 0)
+
+    try:
+        sizes = FULL_SIZES if args.full else args.sizes
+        benchmark = run(args.file_path, sizes, args.stages, args.repeat, args.seed, args.data_dir)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    output = args.output or os.path.join("benchmarks", f"{benchmark['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
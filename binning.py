@@ -0,0 +1,35 @@
+import numpy as np
+
+# Above this many respondents the scatter plots draw one count-weighted marker per distinct point
+BINNED_THRESHOLD = 20000
+
+
+def bin_counts(group_codes, n_groups, values, decimals=2, weights=None):
+    # Respondents (or their summed weights) per (group, value) bin from a single bincount over the combined codes.
+    # Values are rounded first so the number of bins stays small for any scoring scheme.
+    values = np.asarray(values, dtype=np.float64)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    values, value_codes = np.unique(values, return_inverse=True)
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    counts = np.bincount(group_codes * len(values) + value_codes.ravel(), weights=weights,
+                         minlength=n_groups * len(values))
+    return values, counts.reshape(n_groups, len(values))
+
+
+def bin_weights(counts, weighted_counts):
+    # Mean respondent weight of every bin (1 for empty bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, weighted_counts / counts, 1.0)
+
+
+def weighted_means(values, counts):
+    # Mean value per group (row) of a bin count matrix, NaN for an empty group
+    totals = counts.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (counts * np.asarray(values, dtype=np.float64)).sum(axis=1) / totals
+
+
+def marker_sizes(counts, most, smallest=10, largest=400):
+    # Marker area proportional to the number of respondents in the bin
+    return smallest + (largest - smallest) * np.asarray(counts) / max(most, 1)
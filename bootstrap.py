@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+# Normal CDF and quantile, scipy.special loads far faster than scipy.stats
+from scipy.special import ndtr, ndtri
+from profiling import profiled
+
+BOOTSTRAP_RESAMPLES = 10000
+
+# Upper bound on the bytes of resample counts held in memory at once
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+def bootstrap_means(values, counts, resamples=BOOTSTRAP_RESAMPLES, seed=0, memory_budget=MEMORY_BUDGET,
+                    weights=None):
+    # Bootstrap means of every group at once from a (groups x distinct values) count matrix.
+    # Resampling a group's n rows with replacement is the same as drawing multinomial counts over its
+    # distinct values, so no rows are copied and the cost does not depend on the number of respondents.
+    # With survey weights (the mean respondent weight of every bin) each resample gives a weighted mean.
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    n_groups, n_values = counts.shape
+    sizes = counts.sum(axis=1)
+    weights = np.ones(counts.shape) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    probabilities = counts / np.maximum(sizes, 1)[:, None]
+    probabilities[sizes == 0, 0] = 1
+
+    # A block holds two arrays of 8-byte draws: the integer counts and their weighted float copy, which is
+    # then multiplied by the values in place. Both are released before the next block is drawn.
+    rng = np.random.default_rng(seed)
+    block = max(1, memory_budget // (2 * 8 * n_groups * n_values))
+    means = np.empty((resamples, n_groups))
+    for start in range(0, resamples, block):
+        size = min(block, resamples - start)
+        draws = rng.multinomial(sizes, probabilities, size=(size, n_groups))
+        weighted = draws * weights
+        del draws
+        totals = weighted.sum(axis=2)
+        np.multiply(weighted, values, out=weighted)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[start:start + size] = weighted.sum(axis=2) / totals
+        del weighted
+    return means
+
+
+def jackknife_acceleration(values, counts, weights=None):
+    # BCa acceleration from the leave-one-out means; every respondent with the same value gives the same one
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.ones(counts.shape) if weights is None else np.asarray(weights, dtype=np.float64)
+    sizes = counts.sum(axis=1, keepdims=True)
+    totals = (counts * weights * values).sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        leave_one_out = (totals - weights * values) / ((counts * weights).sum(axis=1, keepdims=True) - weights)
+        centre = (counts * leave_one_out).sum(axis=1, keepdims=True) / sizes
+        deviation = centre - leave_one_out
+        return (counts * deviation ** 3).sum(axis=1) / (6 * (counts * deviation ** 2).sum(axis=1) ** 1.5)
+
+
+@profiled("bootstrap.intervals")
+def bootstrap_intervals(values, counts, resamples=BOOTSTRAP_RESAMPLES, confidence=0.95, method="bca",
+                        seed=0, memory_budget=MEMORY_BUDGET, weights=None):
+    # Percentile or BCa confidence interval of the (weighted) mean of every group (row) of a count matrix
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    sizes = counts.sum(axis=1)
+    weighted_counts = counts if weights is None else counts * np.asarray(weights, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        estimates = (weighted_counts * values).sum(axis=1) / weighted_counts.sum(axis=1)
+
+    means = bootstrap_means(values, counts, resamples, seed, memory_budget, weights)
+    alphas = np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+
+    if method == "percentile":
+        levels = np.tile(alphas, (len(sizes), 1))
+    elif method == "bca":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bias = ndtri((means < estimates).mean(axis=0))
+            acceleration = np.nan_to_num(jackknife_acceleration(values, counts, weights))
+            z = ndtri(alphas)
+            adjusted = bias[:, None] + z
+            levels = ndtr(bias[:, None] + adjusted / (1 - acceleration[:, None] * adjusted))
+        # A constant group has no spread to correct, fall back to the percentile levels
+        levels = np.where(np.isfinite(levels), levels, alphas)
+    else:
+        raise ValueError(f"Unknown bootstrap method: {method}")
+
+    lower = np.full(len(sizes), np.nan)
+    upper = np.full(len(sizes), np.nan)
+    for i in np.flatnonzero(sizes > 0):
+        lower[i], upper[i] = np.quantile(means[:, i], levels[i])
+
+    return pd.DataFrame({"n": sizes, "mean": estimates, "lower": lower, "upper": upper})
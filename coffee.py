@@ -0,0 +1,152 @@
+import argparse
+import os
+import sys
+
+# Figures are only ever saved to files, so matplotlib never needs a GUI backend
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+# Every subcommand imports the analysis modules it uses when it runs, so a single small report does not
+# pay for loading scipy, seaborn or scikit-learn.
+
+
+def survey_filters(args):
+    # Waves and age groups kept; on a store (see store.py) the other partitions are never read
+    from loader import AGE
+    from store import WAVE
+    filters = {}
+    if args.wave:
+        filters[WAVE] = args.wave
+    if args.age:
+        filters[AGE] = args.age
+    return filters
+
+
+def load(args, columns):
+    from loader import load_survey
+    try:
+        return load_survey(args.file_path, columns, filters=survey_filters(args))
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+    except KeyError as error:
+        print(f"Error: {error.args[0]}")
+        sys.exit(1)
+
+
+def output_path(args, name):
+    return os.path.join(args.output_dir, name)
+
+
+def load_weighted(args, columns):
+    # The survey with the weighting questions, and the raking weights of the respondents (None if --unweighted)
+    from weighting import survey_weights, COLUMNS as WEIGHTING_COLUMNS
+    data = load(args, list(dict.fromkeys(columns + WEIGHTING_COLUMNS)))
+    return data, None if args.unweighted else survey_weights(data)
+
+
+def demographics_command(args):
+    import demographics
+    data = load(args, demographics.COLUMNS)
+    demographics.plot_age_distribution(data, output_path(args, "age_distribution.png"))
+
+
+def score_command(args):
+    import coffeeScore
+    data, weights = load_weighted(args, coffeeScore.COLUMNS)
+    resamples = coffeeScore.BOOTSTRAP_RESAMPLES if args.resamples is None else args.resamples
+    coffeeScore.plot_scores(coffeeScore.score_by_age(data, weights), output_path(args, "Coffee_Score"),
+                            resamples=resamples)
+
+
+def cups_command(args):
+    import cupcomp
+    data, weights = load_weighted(args, cupcomp.COLUMNS)
+    cupcomp.plot_cups(cupcomp.score_by_cups(data, weights), output_path(args, "Cup_Comparison.png"))
+
+
+def stats_command(args):
+    import statTest
+    if args.chunksize and not survey_filters(args) and not os.path.isdir(args.file_path):
+        # Streamed tables are always unweighted
+        try:
+            tables = statTest.build_tables_chunked(args.file_path, args.chunksize)
+        except FileNotFoundError:
+            print(f"Error: File not found at {args.file_path}")
+            sys.exit(1)
+    else:
+        tables = statTest.build_tables(*load_weighted(args, statTest.COLUMNS))
+    statTest.report(tables, args.permutations, args.seed, args.jobs or None)
+    statTest.plot_all(tables, args.output_dir)
+
+
+def rf_command(args):
+    import machinelearningRF
+    data = load(args, machinelearningRF.COLUMNS)
+    model = machinelearningRF.train_model(data)
+    machinelearningRF.plot_predictions(model, output_path(args, "Coffee_Score_Predicted.png"))
+    machinelearningRF.report(model)
+    if args.save_model:
+        machinelearningRF.save_model(model, args.save_model)
+        print(f"Model saved to {args.save_model}")
+
+
+def all_command(args):
+    import pipeline
+    data = load(args, pipeline.COLUMNS)
+    cache_dir = None if args.no_cache else pipeline.default_cache_dir(args.file_path)
+    results = pipeline.run(data, args.jobs, args.output_dir, cache_dir, weighted=not args.unweighted)
+    pipeline.statTest.report(results["stat_tables"])
+    pipeline.machinelearningRF.report(results["rf_model"])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="coffee", description="Coffee survey analyses")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+    def add(name, command, help):
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument("file_path", help="path to the survey CSV or a store directory")
+        subparser.add_argument("--output-dir", default=".", help="directory the figures are written to")
+        subparser.add_argument("--wave", nargs="+", default=None, help="only these waves of a store")
+        subparser.add_argument("--age", nargs="+", default=None, help="only these age groups")
+        subparser.set_defaults(command=command)
+        return subparser
+
+    def weighted(subparser):
+        subparser.add_argument("--unweighted", action="store_true",
+                               help="count every respondent equally instead of raking to population margins")
+        return subparser
+
+    add("demographics", demographics_command, "age distribution of the respondents")
+
+    score = weighted(add("score", score_command, "combined taste score by age group"))
+    score.add_argument("--resamples", type=int, default=None,
+                       help="bootstrap resamples of the confidence intervals (0 to turn them off)")
+
+    weighted(add("cups", cups_command, "combined taste score by cups per day"))
+
+    stats = weighted(add("stats", stats_command, "chi-square tests between age group and coffee habits"))
+    stats.add_argument("--chunksize", type=int, default=None,
+                       help="stream the CSV in chunks of this many rows instead of loading it whole")
+    stats.add_argument("--permutations", type=int, default=None,
+                       help="also run a Monte Carlo permutation test with this many permutations")
+    stats.add_argument("--seed", type=int, default=0, help="seed of the permutation test")
+    stats.add_argument("--jobs", type=int, default=1, help="permutation worker processes (0 for all cores)")
+
+    rf = add("rf", rf_command, "random forest prediction of the combined score")
+    rf.add_argument("--save-model", default=None, metavar="PATH",
+                    help="save the fitted encoder, scaler and forest for predict.py")
+
+    every = weighted(add("all", all_command, "every analysis from a single load of the survey"))
+    every.add_argument("--jobs", type=int, default=None, help="figure render processes (default: all cores)")
+    every.add_argument("--no-cache", action="store_true", help="recompute every stage and figure")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    args.command(args)
+
+if __name__ == "__main__":
+    main()
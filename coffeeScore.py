@@ -1,92 +1,117 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import argparse
 import sys
-
-# Define scoring dictionaries for preferences
-taste_scores = {
-    "Fruity": 3, "Chocolatey": 5, "Full-Bodied": 7, "Bright": 4, "Nutty": 6,
-    "Sweet": 2, "Caramalized": 5, "Juicy": 4, "Bold": 8, "Floral": 3, "Complex": 6, "Light": 1
-}
-
-strength_scores = {
-    "Light": 1, "Medium": 3, "Dark": 5, "Nordic": 2, "Blonde": 2, "Italian": 4, "French": 5
-}
-
-roast_scores = {
-    "Somewhat strong": 3, "Medium": 5, "Very strong": 7, "Somewhat light": 2, "Weak": 1
-}
-
-def main():
-    # Ensure the file path is provided
-    if len(sys.argv) != 2:
-        print("Usage: python coffee_preferences.py <path_to_csv>")
-        sys.exit(1)
-
-    # Load the CSV file
-    file_path = sys.argv[1]
-    try:
-        data = pd.read_csv(file_path)
-    except FileNotFoundError:
-        print(f"Error: File not found at {file_path}")
-        sys.exit(1)
-
-    # Filtering relevant columns
-    relevant_columns = [
-        "Before today's tasting, which of the following best described what kind of coffee you like?",
-        "How strong do you like your coffee?",
-        "What roast level of coffee do you prefer?",
-        "What is your age?"
-    ]
-
-    filtered_data = data[relevant_columns]
+from loader import load_survey, AGE, TASTE, STRENGTH, ROAST
+from scoring import score, DEFAULT_SCHEME
+from matplotlib.lines import Line2D
+from bootstrap import BOOTSTRAP_RESAMPLES, bootstrap_intervals
+from binning import BINNED_THRESHOLD, bin_counts, bin_weights, weighted_means, marker_sizes
+from weighting import survey_weights, COLUMNS as WEIGHTING_COLUMNS
+from profiling import profiled, stage
+
+# Filtering relevant columns
+COLUMNS = [TASTE, STRENGTH, ROAST, AGE]
+
+@profiled("coffeeScore.score")
+def score_by_age(data, weights=None, scheme=DEFAULT_SCHEME):
+    filtered_data = data[COLUMNS].copy()
     filtered_data.columns = ["Taste Preference", "Strength Preference", "Roast Preference", "Age Group"]
 
-    # Map scores to each category
-    filtered_data["Taste Score"] = filtered_data["Taste Preference"].map(taste_scores)
-    filtered_data["Strength Score"] = filtered_data["Strength Preference"].map(strength_scores)
-    filtered_data["Roast Score"] = filtered_data["Roast Preference"].map(roast_scores)
+    # Score each category and average the scores
+    filtered_data = filtered_data.join(score(data, scheme))
 
-    # Calculate the combined score and average it
-    filtered_data["Combined Score"] = (
-        filtered_data[["Taste Score", "Strength Score", "Roast Score"]].mean(axis=1)
-    )
+    # Survey weights of the respondents (see weighting.py), kept through the filtering below
+    if weights is not None:
+        filtered_data["Weight"] = weights
 
     # Remove rows with missing data for the analysis
     filtered_data = filtered_data.dropna(subset=["Combined Score", "Age Group"])
+    return filtered_data
 
-    # Reorder age groups
-    age_order = ["<18 years old", "18-24 years old", "25-34 years old", "35-44 years old",
-                 "45-54 years old", "55-64 years old", ">65 years old"]
-    filtered_data["Age Group"] = pd.Categorical(filtered_data["Age Group"], categories=age_order, ordered=True)
+@profiled("coffeeScore.plot")
+def plot_scores(filtered_data, output="Coffee_Score", binned=None, resamples=BOOTSTRAP_RESAMPLES):
+    # Large datasets are drawn as one marker per (age group, score) sized by its respondents
+    if binned is None:
+        binned = len(filtered_data) > BINNED_THRESHOLD
 
+    age_groups = filtered_data["Age Group"].cat.categories
+    codes = filtered_data["Age Group"].cat.codes
+    scores, counts = bin_counts(codes, len(age_groups), filtered_data["Combined Score"], decimals=None)
+    weights = None
+    if "Weight" in filtered_data.columns:
+        _, weighted_counts = bin_counts(codes, len(age_groups), filtered_data["Combined Score"], decimals=None,
+                                        weights=filtered_data["Weight"])
+        weights = bin_weights(counts, weighted_counts)
+    if binned:
+        plot_score_counts(age_groups, scores, counts, output, resamples, weights)
+        return
+
+    # Weighted averages come from the weighted bins, NaN for an empty age group like the unweighted mean
+    averages = None if weights is None else weighted_means(scores, counts * weights)
+    points = []
+    for i, age_group in enumerate(age_groups):
+        group_data = filtered_data[filtered_data["Age Group"] == age_group]
+        average = group_data["Combined Score"].mean() if averages is None else averages[i]
+        points.append((group_data["Combined Score"], average, None))
+    draw_scores(age_groups, points, score_intervals(scores, counts, resamples, weights), output)
+
+@profiled("coffeeScore.plot.binned")
+def plot_score_counts(age_groups, scores, counts, output="Coffee_Score", resamples=BOOTSTRAP_RESAMPLES,
+                      weights=None):
+    # Scatter from a (age group x score) count matrix, in constant time whatever the number of respondents.
+    # Markers are sized by respondents; with weights (mean weight of every bin) the averages are weighted.
+    averages = weighted_means(scores, counts if weights is None else counts * weights)
+    points = []
+    for i in range(len(age_groups)):
+        drawn = counts[i] > 0
+        points.append((np.asarray(scores)[drawn], averages[i], marker_sizes(counts[i][drawn], counts.max())))
+    draw_scores(age_groups, points, score_intervals(scores, counts, resamples, weights), output)
+
+def score_intervals(scores, counts, resamples, weights=None):
+    # Bootstrap confidence interval of each age group's mean score, None when turned off
+    if not resamples:
+        return None
+    return bootstrap_intervals(scores, counts, resamples, weights=weights)
+
+def draw_scores(age_groups, points, intervals, output):
     # Plotting the scatterplot
     plt.figure(figsize=(12, 6))
-    age_groups = filtered_data["Age Group"].cat.categories
     colors = plt.cm.tab10(np.linspace(0, 1, len(age_groups)))
 
     scatter_points = []  # To store legend entries
     for i, age_group in enumerate(age_groups):
-        group_data = filtered_data[filtered_data["Age Group"] == age_group]
+        scores, max_average_score, sizes = points[i]
         scatter = plt.scatter(
-            [age_group] * len(group_data),
-            group_data["Combined Score"],
+            [age_group] * len(scores),
+            scores,
+            s=sizes,
             color=colors[i],
             label=age_group,
             alpha=0.7
         )
         scatter_points.append(scatter)
-        
+
         # Highlight the average highest score for this age group
-        max_average_score = group_data["Combined Score"].mean()
         avg_high_marker = plt.scatter(
             [age_group], [max_average_score], 
             color="black", marker="*", s=150
         )
 
+        # Error bar for the 95% bootstrap confidence interval of the average
+        if intervals is not None and intervals["n"][i] > 0:
+            plt.errorbar(
+                [age_group], [max_average_score],
+                yerr=[[max_average_score - intervals["lower"][i]], [intervals["upper"][i] - max_average_score]],
+                color="black", capsize=6, linewidth=1.5
+            )
+
     # Add a manual legend to ensure Avg High is at the top
     legend_entries = [avg_high_marker] + scatter_points
     legend_labels = ["Avg High"] + list(age_groups)
+    if intervals is not None:
+        legend_entries.insert(1, Line2D([], [], color="black", marker="_", markersize=10, linewidth=1.5))
+        legend_labels.insert(1, "95% Bootstrap CI")
 
     plt.title("Coffee Taste Preferences by Age Group")
     plt.xlabel("Age Group")
@@ -95,9 +120,26 @@ def main():
     plt.xticks(rotation=10)
     plt.grid(alpha=0.3)
     plt.tight_layout()
-    plt.savefig("Coffee_Score", format='png', dpi=300)
-    
-    
+    with stage("coffeeScore.savefig"):
+        plt.savefig(output, format='png', dpi=300)
+    plt.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Combined taste score by age group")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--unweighted", action="store_true", help="count every respondent equally")
+    args = parser.parse_args()
+
+    # Load only the relevant columns
+    file_path = args.file_path
+    try:
+        data = load_survey(file_path, list(dict.fromkeys(COLUMNS + WEIGHTING_COLUMNS)))
+    except FileNotFoundError:
+        print(f"Error: File not found at {file_path}")
+        sys.exit(1)
+
+    weights = None if args.unweighted else survey_weights(data)
+    plot_scores(score_by_age(data, weights))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import sys
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from loader import load_survey, snapshot_path, AGE, CUPS, TASTE, STRENGTH, ROAST
+from scoring import score, DEFAULT_SCHEME
+from profiling import profiled
+
+# Cube dimensions: short name -> survey column
+DIMENSIONS = {
+    "age": AGE,
+    "gender": "Gender",
+    "education": "Education Level",
+    "employment": "Employment Status",
+    "cups": CUPS,
+    "roast": ROAST,
+    "strength": STRENGTH,
+    "taste": TASTE,
+}
+
+# Per cell: respondents, respondents with a Combined Score, and the sum and sum of squares of their scores
+MEASURES = ["respondents", "scored", "score_sum", "score_sumsq"]
+
+CUBE_FILE = "cube.npz"
+MISSING = "(missing)"
+
+
+@profiled("cube.build")
+def build_cube(data, scheme=DEFAULT_SCHEME):
+    # Sparse cube: one cell per combination of answers that occurs, a missing answer is its own level.
+    # The number of cells is bounded by the number of distinct answer combinations, not respondents.
+    levels = {}
+    codes = []
+    for name, column in DIMENSIONS.items():
+        values = data[column].astype("category")
+        levels[name] = [str(level) for level in values.cat.categories]
+        level_codes = values.cat.codes.to_numpy(dtype=np.int64)
+        codes.append(np.where(level_codes >= 0, level_codes, len(levels[name])))
+    shape = [len(levels[name]) + 1 for name in DIMENSIONS]
+    keys, cells = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    cells = cells.ravel()
+
+    scores = score(data, scheme)["Combined Score"].to_numpy()
+    scored = ~np.isnan(scores)
+    scores = np.where(scored, scores, 0)
+    measures = np.column_stack([
+        np.bincount(cells, minlength=len(keys)),
+        np.bincount(cells, weights=scored, minlength=len(keys)),
+        np.bincount(cells, weights=scores, minlength=len(keys)),
+        np.bincount(cells, weights=scores * scores, minlength=len(keys)),
+    ])
+    return {"levels": levels, "scheme": scheme, "coords": np.column_stack(np.unravel_index(keys, shape)),
+            "measures": measures}
+
+
+def save_cube(path, cube):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, coords=cube["coords"], measures=cube["measures"],
+             meta=np.array(json.dumps({"levels": cube["levels"], "scheme": cube["scheme"]})))
+    os.replace(tmp_path, path)
+
+
+def read_cube(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        meta = json.loads(str(saved["meta"]))
+        return {"levels": meta["levels"], "scheme": meta["scheme"], "coords": saved["coords"],
+                "measures": saved["measures"]}
+
+
+@lru_cache(maxsize=4)
+def open_cube(file_path, rebuild=False):
+    # The cube of a survey CSV, kept next to its snapshot and rebuilt when the scoring scheme changed
+    path = os.path.join(snapshot_path(file_path), CUBE_FILE)
+    cube = None if rebuild else read_cube(path)
+    if cube is None or cube["scheme"] != json.loads(json.dumps(DEFAULT_SCHEME)):
+        cube = build_cube(load_survey(file_path, list(DIMENSIONS.values())))
+        save_cube(path, cube)
+    return cube
+
+
+def query(cube, by=(), where=(), include_missing=False):
+    # Any marginal or crosstab: cells matching the filters are summed per combination of the "by" dimensions.
+    # where holds (dimension, answer) pairs; several answers for one dimension match any of them.
+    names = list(DIMENSIONS)
+    for name in list(by) + [name for name, _ in where]:
+        if name not in DIMENSIONS:
+            raise KeyError(f"Unknown dimension {name}, expected one of {', '.join(names)}")
+
+    coords, measures = cube["coords"], cube["measures"]
+    selected = np.ones(len(coords), dtype=bool)
+    allowed = {}
+    for name, answer in where:
+        allowed.setdefault(name, []).append(answer)
+    for name, answers in allowed.items():
+        level_codes = [cube["levels"][name].index(answer) for answer in answers if answer in cube["levels"][name]]
+        selected &= np.isin(coords[:, names.index(name)], level_codes)
+    if not include_missing:
+        for name in by:
+            selected &= coords[:, names.index(name)] < len(cube["levels"][name])
+
+    axes = [names.index(name) for name in by]
+    shape = [len(cube["levels"][name]) + 1 for name in by]
+    if by:
+        keys = np.ravel_multi_index(coords[selected][:, axes].T, shape)
+    else:
+        keys = np.zeros(selected.sum(), dtype=np.int64)
+    groups, group_codes = np.unique(keys, return_inverse=True)
+    totals = np.column_stack([np.bincount(group_codes.ravel(), weights=measures[selected, i], minlength=len(groups))
+                              for i in range(len(MEASURES))])
+
+    labels = np.unravel_index(groups, shape) if by else []
+    result = pd.DataFrame({name: [(cube["levels"][name] + [MISSING])[code] for code in labels[i]]
+                           for i, name in enumerate(by)})
+    result["Respondents"] = totals[:, 0].astype(np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = totals[:, 2] / totals[:, 1]
+        variance = (totals[:, 3] - totals[:, 1] * mean * mean) / (totals[:, 1] - 1)
+    result["Mean Score"] = mean
+    result["Std Score"] = np.sqrt(np.maximum(variance, 0))
+    return result
+
+
+@lru_cache(maxsize=1024)
+def cached_query(file_path, by=(), where=(), include_missing=False):
+    return query(open_cube(file_path), by, where, include_missing)
+
+
+def parse_where(value):
+    name, separator, answer = value.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Filters are written DIMENSION=ANSWER, got {value}")
+    return name, answer
+
+
+def handler_for(file_path):
+    class QueryHandler(BaseHTTPRequestHandler):
+        # GET /dimensions, or GET /query?by=age&by=gender&where=roast=Dark[&missing=1]
+        def do_GET(self):
+            url = urlparse(self.path)
+            parameters = parse_qs(url.query)
+            try:
+                if url.path == "/dimensions":
+                    body = {name: open_cube(file_path)["levels"][name] for name in DIMENSIONS}
+                elif url.path == "/query":
+                    where = tuple(parse_where(value) for value in parameters.get("where", []))
+                    result = cached_query(file_path, tuple(parameters.get("by", [])), where,
+                                          parameters.get("missing", ["0"])[0] == "1")
+                    body = {"rows": json.loads(result.to_json(orient="records"))}
+                else:
+                    self.send_error(404, "Use /dimensions or /query")
+                    return
+            except (KeyError, argparse.ArgumentTypeError) as error:
+                self.send_error(400, str(error.args[0]))
+                return
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return QueryHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count cube over the main survey dimensions")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("command", choices=["build", "query", "serve"])
+    parser.add_argument("--by", nargs="*", default=[], choices=list(DIMENSIONS), help="dimensions to group by")
+    parser.add_argument("--where", type=parse_where, action="append", default=[], metavar="DIMENSION=ANSWER",
+                        help="only cells with this answer, can be repeated")
+    parser.add_argument("--missing", action="store_true", help="keep missing answers of the --by dimensions")
+    parser.add_argument("--crosstab", action="store_true", help="show two --by dimensions as a respondent table")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file_path):
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    if args.command == "build":
+        cube = open_cube(args.file_path, rebuild=True)
+        print(f"Built a cube of {len(cube['coords'])} cells over {', '.join(DIMENSIONS)}")
+    elif args.command == "query":
+        try:
+            result = cached_query(args.file_path, tuple(args.by), tuple(args.where), args.missing)
+        except KeyError as error:
+            print(f"Error: {error.args[0]}")
+            sys.exit(1)
+        if args.crosstab and len(args.by) == 2:
+            # Rows and columns in the cube's answer order; pivot sorts them as text
+            table = result.pivot(index=args.by[0], columns=args.by[1], values="Respondents").fillna(0).astype(int)
+            levels = open_cube(args.file_path)["levels"]
+            rows, columns = ([level for level in levels[name] + [MISSING] if level in set(result[name])]
+                             for name in args.by)
+            print(table.loc[rows, columns].to_string())
+        else:
+            print(result.to_string(index=False))
+    else:
+        open_cube(args.file_path)
+        server = ThreadingHTTPServer((args.host, args.port), handler_for(args.file_path))
+        print(f"Serving cube queries on http://{args.host}:{args.port}/query")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+if __name__ == "__main__":
+    main()
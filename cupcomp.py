@@ -1,69 +1,97 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import argparse
 import sys
+from loader import load_survey, CUPS, TASTE, STRENGTH, ROAST
+from scoring import score, DEFAULT_SCHEME
+from binning import BINNED_THRESHOLD, bin_counts, weighted_means, marker_sizes
+from weighting import survey_weights, COLUMNS as WEIGHTING_COLUMNS
+from profiling import profiled, stage
 
-taste_scores = {
-    "Fruity": 3, "Chocolatey": 5, "Full-Bodied": 7, "Bright": 4, "Nutty": 6,
-    "Sweet": 2, "Caramalized": 5, "Juicy": 4, "Bold": 8, "Floral": 3, "Complex": 6, "Light": 1
-}
+COLUMNS = [TASTE, STRENGTH, ROAST, CUPS]
 
-strength_scores = {
-    "Light": 1, "Medium": 3, "Dark": 5, "Nordic": 2, "Blonde": 2, "Italian": 4, "French": 5
-}
-
-roast_scores = {
-    "Somewhat strong": 3, "Medium": 5, "Very strong": 7, "Somewhat light": 2, "Weak": 1
-}
-
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python coffee_analysis.py <path_to_csv>")
-        sys.exit(1)
-
-    file_path = sys.argv[1]
-    try:
-        data = pd.read_csv(file_path)
-    except FileNotFoundError:
-        print(f"Error: File not found at {file_path}")
-        sys.exit(1)
+@profiled("cupcomp.score")
+def score_by_cups(data, weights=None, scheme=DEFAULT_SCHEME):
+    filtered_data = data[COLUMNS].copy()
+    filtered_data.columns = ["Taste Preference", "Strength Preference", "Roast Preference", "Cups Per Day"]
 
-    relevant_columns = [
-        "Before today's tasting, which of the following best described what kind of coffee you like?",
-        "How strong do you like your coffee?",
-        "What roast level of coffee do you prefer?",
-        "How many cups of coffee do you typically drink per day?"
-    ]
+    filtered_data = filtered_data.join(score(data, scheme))
+    if weights is not None:
+        filtered_data["Weight"] = weights
 
-    filtered_data = data[relevant_columns]
-    filtered_data.columns = ["Taste Preference", "Strength Preference", "Roast Preference", "Cups Per Day"]
+    filtered_data["Cups Per Day"] = pd.to_numeric(filtered_data["Cups Per Day"].astype(str), errors="coerce")
+    filtered_data = filtered_data.dropna(subset=["Combined Score", "Cups Per Day"])
+    return filtered_data
 
-    filtered_data["Taste Score"] = filtered_data["Taste Preference"].map(taste_scores)
-    filtered_data["Strength Score"] = filtered_data["Strength Preference"].map(strength_scores)
-    filtered_data["Roast Score"] = filtered_data["Roast Preference"].map(roast_scores)
+@profiled("cupcomp.plot")
+def plot_cups(filtered_data, output="Cup_Comparison.png", binned=None):
+    # Large datasets are drawn as one marker per (score, cups) pair sized by its respondents
+    if binned is None:
+        binned = len(filtered_data) > BINNED_THRESHOLD
 
-    filtered_data["Combined Score"] = (
-        filtered_data[["Taste Score", "Strength Score", "Roast Score"]].mean(axis=1)
-    )
+    weights = filtered_data["Weight"] if "Weight" in filtered_data.columns else None
+    if binned:
+        cup_counts, cup_codes = np.unique(filtered_data["Cups Per Day"].to_numpy(), return_inverse=True)
+        scores, counts = bin_counts(cup_codes.ravel(), len(cup_counts), filtered_data["Combined Score"])
+        weighted_counts = None
+        if weights is not None:
+            _, weighted_counts = bin_counts(cup_codes.ravel(), len(cup_counts), filtered_data["Combined Score"],
+                                            weights=weights)
+        plot_cup_counts(cup_counts, scores, counts, output, weighted_counts)
+        return
 
-    filtered_data["Cups Per Day"] = pd.to_numeric(filtered_data["Cups Per Day"], errors="coerce")
-    filtered_data = filtered_data.dropna(subset=["Combined Score", "Cups Per Day"])
+    if weights is None:
+        avg_scores_per_cup = filtered_data.groupby("Cups Per Day")["Combined Score"].mean()
+    else:
+        totals = (filtered_data["Combined Score"] * weights).groupby(filtered_data["Cups Per Day"]).sum()
+        avg_scores_per_cup = totals / weights.groupby(filtered_data["Cups Per Day"]).sum()
+    draw_cups(filtered_data["Combined Score"], filtered_data["Cups Per Day"], None,
+              avg_scores_per_cup.values, avg_scores_per_cup.index, output)
 
-    avg_scores_per_cup = filtered_data.groupby("Cups Per Day")["Combined Score"].mean()
-    cup_counts = avg_scores_per_cup.index
-    scores = avg_scores_per_cup.values
+@profiled("cupcomp.plot.binned")
+def plot_cup_counts(cup_counts, scores, counts, output="Cup_Comparison.png", weighted_counts=None):
+    # Scatter from a (cups x score) count matrix, in constant time whatever the number of respondents.
+    # Markers are sized by respondents, the averages use the summed survey weights of the bins when given.
+    cup_counts = np.asarray(cup_counts, dtype=np.float64)
+    order = np.argsort(cup_counts)
+    cup_counts, counts = cup_counts[order], counts[order]
+    weighted_counts = counts if weighted_counts is None else weighted_counts[order]
+    rows, columns = np.nonzero(counts)
+    draw_cups(np.asarray(scores)[columns], cup_counts[rows], marker_sizes(counts[rows, columns], counts.max()),
+              weighted_means(scores, weighted_counts), cup_counts, output)
 
+def draw_cups(point_scores, point_cups, sizes, scores, cup_counts, output):
     plt.figure(figsize=(10, 6))
-    plt.scatter(filtered_data["Combined Score"], filtered_data["Cups Per Day"], alpha=0.7, label="Data Points")
+    plt.scatter(point_scores, point_cups, s=sizes, alpha=0.7, label="Data Points")
     plt.scatter(scores, cup_counts, color="red", marker="*", s=150, label="Average per Cup")
 
-    for score, cup_count in zip(scores, cup_counts):
-        plt.text(score, cup_count, f"{score:.2f}", fontsize=9, ha='left', va='center')
+    for cup_score, cup_count in zip(scores, cup_counts):
+        plt.text(cup_score, cup_count, f"{cup_score:.2f}", fontsize=9, ha='left', va='center')
 
     plt.title("Coffee Score Vs Daily Cups of Coffee")
     plt.xlabel("Coffee Score")
     plt.ylabel("Cups of Coffee Per Day")
     plt.legend()
-    plt.savefig("Cup_Comparison.png", format="png", dpi=300)
+    with stage("cupcomp.savefig"):
+        plt.savefig(output, format="png", dpi=300)
+    plt.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Combined taste score by cups of coffee per day")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--unweighted", action="store_true", help="count every respondent equally")
+    args = parser.parse_args()
+
+    file_path = args.file_path
+    try:
+        data = load_survey(file_path, list(dict.fromkeys(COLUMNS + WEIGHTING_COLUMNS)))
+    except FileNotFoundError:
+        print(f"Error: File not found at {file_path}")
+        sys.exit(1)
+
+    weights = None if args.unweighted else survey_weights(data)
+    plot_cups(score_by_cups(data, weights))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
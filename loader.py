@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from profiling import profiled
+
+# Column names shared by the analysis scripts
+SUBMISSION_ID = "Submission ID"
+AGE = "What is your age?"
+CUPS = "How many cups of coffee do you typically drink per day?"
+TASTE = "Before today's tasting, which of the following best described what kind of coffee you like?"
+STRENGTH = "How strong do you like your coffee?"
+ROAST = "What roast level of coffee do you prefer?"
+
+AGE_ORDER = ["<18 years old", "18-24 years old", "25-34 years old", "35-44 years old",
+             "45-54 years old", "55-64 years old", ">65 years old"]
+
+BREWING_COLUMNS = [
+    "How do you brew coffee at home? (Pour over)",
+    "How do you brew coffee at home? (French press)",
+    "How do you brew coffee at home? (Espresso)",
+    "How do you brew coffee at home? (Coffee brewing machine (e.g. Mr. Coffee))",
+    "How do you brew coffee at home? (Pod/capsule machine (e.g. Keurig/Nespresso))",
+    "How do you brew coffee at home? (Instant coffee)",
+    "How do you brew coffee at home? (Bean-to-cup machine)",
+    "How do you brew coffee at home? (Cold brew)",
+    "How do you brew coffee at home? (Coffee extract (e.g. Cometeer))",
+    "How do you brew coffee at home? (Other)"
+]
+
+# Answers with a natural order are parsed straight into ordered categoricals
+ORDERED_ANSWERS = {
+    AGE: AGE_ORDER,
+    CUPS: ["Less than 1", "1", "2", "3", "4", "More than 4"],
+    STRENGTH: ["Weak", "Somewhat light", "Medium", "Somewhat strong", "Very strong"],
+    "In total, much money do you typically spend on coffee in a month?":
+        ["<$20", "$20-$40", "$40-$60", "$60-$80", "$80-$100", ">$100"],
+    "Education Level": ["Less than high school", "High school graduate", "Some college or associate's degree",
+                        "Bachelor's degree", "Master's degree", "Doctorate or professional degree"],
+}
+
+RATING_SUFFIXES = (" - Bitterness", " - Acidity", " - Personal Preference")
+EXPERTISE = "Lastly, how would you rate your own coffee expertise?"
+
+# Free-text answers ("Other" write-ins and the tasting notes)
+FREE_TEXT_COLUMNS = [
+    "How else do you brew coffee at home?",
+    "Where else do you purchase coffee?",
+    "Please specify what your favorite coffee drink is",
+    "What else do you add to your coffee?",
+    "What other flavoring do you use?",
+    "Coffee A - Notes",
+    "Coffee B - Notes",
+    "Coffee C - Notes",
+    "Coffee D - Notes",
+    "Other reason for drinking coffee",
+    "Gender (please specify)",
+    "Ethnicity/Race (please specify)",
+]
+
+CACHE_DIR = ".survey_cache"
+
+# Part of every snapshot key, bump it when a change to the parsing or the snapshot layout changes what is stored
+SNAPSHOT_FORMAT = 1
+
+# Size, modification time and content hash of every CSV with a snapshot in a cache directory
+HASHES_FILE = "hashes.json"
+
+# A partitioned multi-wave store (see store.py) is a directory holding this manifest
+MANIFEST_FILE = "_manifest.json"
+
+
+def read_header(file_path):
+    if os.path.isdir(file_path):
+        # store imports this module, so it is imported where it is needed
+        from store import store_columns
+        return store_columns(file_path)
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+def is_checkbox(column, header):
+    # Multi-select options are stored as "<question> (<option>)" next to the "<question>" column
+    if column.endswith("(please specify)"):
+        return False
+    return any(column != question and column.startswith(question + " (") for question in header)
+
+
+def column_dtype(column, header):
+    if is_checkbox(column, header):
+        return "boolean"
+    if column == EXPERTISE or column.endswith(RATING_SUFFIXES):
+        return "float64"
+    if column in ORDERED_ANSWERS:
+        return pd.CategoricalDtype(ORDERED_ANSWERS[column], ordered=True)
+    return "category"
+
+
+def order_answers(values, column):
+    # Ordered categorical of an answer column. Answers missing from the known order (e.g. from a new wave)
+    # are kept after the known ones, sorted, instead of being turned into missing values.
+    values = pd.Categorical(values)
+    order = ORDERED_ANSWERS[column]
+    extra = sorted(set(values.categories) - set(order))
+    return values.set_categories(order + extra, ordered=True)
+
+
+def order_columns(data):
+    # Parsed columns of ORDERED_ANSWERS are plain categoricals until they are ordered here
+    for column in data.columns:
+        if column in ORDERED_ANSWERS:
+            data[column] = order_answers(data[column], column)
+    return data
+
+
+def drop_unused_answers(data, columns):
+    # After filtering, answers of these columns no kept respondent gave stop being categories, so an age group
+    # left out by --age is not tabled or plotted as an empty group
+    for column in columns:
+        if column in data.columns and isinstance(data[column].dtype, pd.CategoricalDtype):
+            data[column] = data[column].cat.remove_unused_categories()
+    return data
+
+
+def file_hash(file_path):
+    # A store is identified by its manifest, which every ingest rewrites
+    if os.path.isdir(file_path):
+        file_path = os.path.join(file_path, MANIFEST_FILE)
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def column_file(column):
+    return hashlib.sha1(column.encode("utf-8")).hexdigest()[:16] + ".npy"
+
+
+def column_dtypes(file_path, columns, header=None):
+    # Parsing dtypes: ordered answers are read as plain categoricals and ordered by order_columns,
+    # parsing straight into the ordered dtype would drop unknown answers
+    if header is None:
+        header = read_header(file_path)
+    dtypes = {column: column_dtype(column, header) for column in columns}
+    return {column: "category" if column in ORDERED_ANSWERS else dtype for column, dtype in dtypes.items()}
+
+
+@profiled("loader.parse_csv")
+def read_columns(file_path, columns, header=None):
+    # Parse only the requested columns, each straight into its final dtype
+    dtypes = column_dtypes(file_path, columns, header)
+    return order_columns(pd.read_csv(file_path, usecols=columns, dtype=dtypes)[columns])
+
+
+def read_chunks(file_path, columns, chunksize):
+    # Stream the requested columns in fixed-size chunks, for files too large to hold in memory
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(file_path)
+    dtypes = column_dtypes(file_path, columns)
+    for chunk in pd.read_csv(file_path, usecols=columns, dtype=dtypes, chunksize=chunksize):
+        yield order_columns(chunk[columns])
+
+
+@profiled("loader.write_snapshot")
+def write_snapshot(snapshot_dir, data, source=None):
+    # One .npy file per column: category codes, -1/0/1 for checkboxes, float64 for ratings.
+    # source is the CSV the snapshot was parsed from, used to find its superseded snapshots.
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta_path = os.path.join(snapshot_dir, "meta.json")
+    meta = read_snapshot_meta(snapshot_dir) or {"rows": len(data), "columns": {}, "format": SNAPSHOT_FORMAT,
+                                                "source": source}
+
+    for column in data.columns:
+        series = data[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.codes.to_numpy()
+            entry = {"kind": "category", "categories": series.cat.categories.tolist(),
+                     "ordered": bool(series.cat.ordered)}
+        elif series.dtype == "boolean":
+            values = series.astype("Int8").fillna(-1).to_numpy(dtype=np.int8)
+            entry = {"kind": "boolean"}
+        else:
+            values = series.to_numpy(dtype=np.float64)
+            entry = {"kind": "numeric"}
+        entry["file"] = column_file(column)
+        np.save(os.path.join(snapshot_dir, entry["file"]), values)
+        meta["columns"][column] = entry
+
+    # Written last so an interrupted run never leaves a half-described snapshot
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def read_snapshot_meta(snapshot_dir):
+    meta_path = os.path.join(snapshot_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@profiled("loader.read_snapshot")
+def read_snapshot(snapshot_dir, columns, meta):
+    frame = {}
+    for column in columns:
+        entry = meta["columns"][column]
+        values = np.load(os.path.join(snapshot_dir, entry["file"]), mmap_mode="r")
+        if entry["kind"] == "category":
+            dtype = pd.CategoricalDtype(entry["categories"], ordered=entry["ordered"])
+            frame[column] = pd.Categorical.from_codes(values, dtype=dtype)
+        elif entry["kind"] == "boolean":
+            frame[column] = pd.arrays.BooleanArray(values == 1, values < 0)
+        else:
+            frame[column] = np.asarray(values)
+    return pd.DataFrame(frame, columns=columns)
+
+
+def default_cache_dir(file_path):
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR)
+
+
+def cached_file_hash(file_path, cache_dir):
+    # Content hash of a CSV, recomputed only when its size or modification time changed since the last load
+    hashes_path = os.path.join(cache_dir, HASHES_FILE)
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path, encoding="utf-8") as f:
+            hashes = json.load(f)
+    source = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    entry = hashes.get(source)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["hash"]
+
+    hashes[source] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash(file_path)}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{hashes_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(hashes, f, indent=1)
+    os.replace(tmp_path, hashes_path)
+    return hashes[source]["hash"]
+
+
+def snapshot_key(content_hash):
+    # The CSV's content, the snapshot format and the answer orders the categoricals were built with
+    description = json.dumps([content_hash, SNAPSHOT_FORMAT, ORDERED_ANSWERS], sort_keys=True)
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def snapshot_path(file_path, cache_dir=None):
+    # Snapshot directory of a CSV, next to it unless another cache directory is given
+    if cache_dir is None:
+        cache_dir = default_cache_dir(file_path)
+    return os.path.join(cache_dir, snapshot_key(cached_file_hash(file_path, cache_dir)))
+
+
+def remove_superseded(snapshot_dir, source):
+    # Delete the other snapshots of the same CSV, left behind by an edit of the file or of the parsing
+    cache_dir = os.path.dirname(snapshot_dir)
+    for entry in os.scandir(cache_dir):
+        if not entry.is_dir() or entry.path == snapshot_dir:
+            continue
+        meta = read_snapshot_meta(entry.path)
+        if meta is not None and meta.get("source") == source:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+@profiled("loader.load")
+def load_survey(file_path, columns=None, cache_dir=None, filters=None):
+    # Load the survey, parsing only the declared columns and caching them as a binary snapshot.
+    # filters maps columns to the answers kept. A store directory is read partition by partition instead,
+    # skipping the waves and age groups the filters leave out.
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(file_path)
+    if os.path.isdir(file_path):
+        from store import read_store
+        return read_store(file_path, columns, filters)
+
+    header = None
+    if columns is None:
+        header = read_header(file_path)
+        columns = header
+    columns = list(columns)
+
+    snapshot_dir = snapshot_path(file_path, cache_dir)
+    meta = read_snapshot_meta(snapshot_dir)
+    cached = set(meta["columns"]) if meta else set()
+    missing = [column for column in columns if column not in cached]
+    if missing:
+        # Only the columns no earlier run has asked for are parsed from the CSV
+        source = os.path.abspath(file_path)
+        write_snapshot(snapshot_dir, read_columns(file_path, missing, header), source)
+        if meta is None:
+            remove_superseded(snapshot_dir, source)
+        meta = read_snapshot_meta(snapshot_dir)
+
+    if not filters:
+        return read_snapshot(snapshot_dir, columns, meta)
+    filtered = [column for column in filters if column not in columns]
+    unknown = set(filtered) - set(read_header(file_path))
+    if unknown:
+        raise KeyError(f"Cannot filter on {', '.join(sorted(unknown))}, not a column of {file_path}")
+    data = load_survey(file_path, columns + filtered, cache_dir)
+    for column, values in filters.items():
+        data = data[data[column].astype(str).isin([str(value) for value in values]).to_numpy()]
+    return drop_unused_answers(data[columns].reset_index(drop=True), filters)
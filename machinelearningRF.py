@@ -1,88 +1,111 @@
+import argparse
+import itertools
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import sklearn
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.preprocessing import OneHotEncoder, MinMaxScaler
+from loader import load_survey, AGE, TASTE, STRENGTH, ROAST
+from scoring import score, DEFAULT_SCHEME
+from profiling import profiled, stage
 
-# Define scoring, with sweeter tastes being lesser score and stronger taste being higher score
-taste_scores = {
-    "Fruity": 3, "Chocolatey": 5, "Full-Bodied": 7, "Bright": 4, "Nutty": 6,
-    "Sweet": 2, "Caramalized": 5, "Juicy": 4, "Bold": 8, "Floral": 3, "Complex": 6, "Light": 1
-}
+# Filtering columns
+COLUMNS = [TASTE, STRENGTH, ROAST, AGE]
 
-strength_scores = {
-    "Light": 1, "Medium": 3, "Dark": 5, "Nordic": 2, "Blonde": 2, "Italian": 4, "French": 5
-}
+# Bump when the saved artifact layout changes
+MODEL_FORMAT = 1
 
-roast_scores = {
-    "Somewhat strong": 3, "Medium": 5, "Very strong": 7, "Somewhat light": 2, "Weak": 1
-}
+# Random what-if inputs drawn per age group in the prediction figure
+RANDOM_INPUTS = 200
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python coffee_preferences.py <path_to_csv>")
-        sys.exit(1)
-
-    file_path = sys.argv[1]
-    try:
-        data = pd.read_csv(file_path)
-    except FileNotFoundError:
-        print(f"Error: File not found at {file_path}")
-        sys.exit(1)
-
-    # Filtering columns
-    relevant_columns = [
-        "Before today's tasting, which of the following best described what kind of coffee you like?",
-        "How strong do you like your coffee?",
-        "What roast level of coffee do you prefer?",
-        "What is your age?"
-    ]
+SCORE_FEATURES = ["Taste Score", "Strength Score", "Roast Score"]
 
-    filtered_data = data[relevant_columns]
+def score_rows(data, scheme=DEFAULT_SCHEME):
+    filtered_data = data[COLUMNS].copy()
     filtered_data.columns = ["Taste Preference", "Strength Preference", "Roast Preference", "Age Group"]
 
-    # Map each category
-    filtered_data["Taste Score"] = filtered_data["Taste Preference"].map(taste_scores)
-    filtered_data["Strength Score"] = filtered_data["Strength Preference"].map(strength_scores)
-    filtered_data["Roast Score"] = filtered_data["Roast Preference"].map(roast_scores)
-
-    # Calculate the combined score and average 
-    filtered_data["Combined Score"] = (
-        filtered_data[["Taste Score", "Strength Score", "Roast Score"]].mean(axis=1)
-    )
+    # Score each category and average the scores
+    filtered_data = filtered_data.join(score(data, scheme))
 
     # Remove rows with missing data
-    filtered_data = filtered_data.dropna(subset=["Combined Score", "Age Group"])
+    return filtered_data.dropna(subset=["Combined Score", "Age Group"])
+
+def feature_matrix(filtered_data, encoder):
+    # Combine features
+    age_encoded = encoder.transform(filtered_data[["Age Group"]])
+    return np.hstack([filtered_data[SCORE_FEATURES].values, age_encoded])
 
-    # For Graphing Axis
-    age_order = ["<18 years old", "18-24 years old", "25-34 years old", "35-44 years old",
-                 "45-54 years old", "55-64 years old", ">65 years old"]
-    filtered_data["Age Group"] = pd.Categorical(filtered_data["Age Group"], categories=age_order, ordered=True)
+@profiled("machinelearningRF.features")
+def build_features(data, scheme=DEFAULT_SCHEME):
+    filtered_data = score_rows(data, scheme)
 
     encoder = OneHotEncoder(sparse_output=False)
-    age_encoded = encoder.fit_transform(filtered_data[["Age Group"]])
+    encoder.fit(filtered_data[["Age Group"]])
 
-    # Combine features
-    X = np.hstack([filtered_data[["Taste Score", "Strength Score", "Roast Score"]].values, age_encoded])
+    X = feature_matrix(filtered_data, encoder)
     y = filtered_data["Combined Score"].values
 
     # Use MinMaxScaler
     scaler = MinMaxScaler()
     X_scaled = scaler.fit_transform(X)
 
+    return {
+        "filtered_data": filtered_data,
+        "encoder": encoder,
+        "scaler": scaler,
+        "X": X_scaled,
+        "y": y,
+    }
+
+@profiled("machinelearningRF.train")
+def train_model(data, scheme=DEFAULT_SCHEME, params=None):
+    features = build_features(data, scheme)
+    X_scaled, y = features["X"], features["y"]
+
     # Split into training and validation data
     X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
 
-    # Train
-    rf = RandomForestRegressor(random_state=42)
-    rf.fit(X_train, y_train)
+    # Train, building the trees on every core
+    rf = RandomForestRegressor(random_state=42, n_jobs=-1, **(params or {}))
+    with stage("machinelearningRF.fit"):
+        rf.fit(X_train, y_train)
+
+    return {
+        "filtered_data": features["filtered_data"],
+        "scheme": scheme,
+        "encoder": features["encoder"],
+        "scaler": features["scaler"],
+        "rf": rf,
+        "n_features": X_scaled.shape[1],
+        "train_score": rf.score(X_train, y_train),
+        "test_score": rf.score(X_test, y_test),
+    }
+
+@profiled("machinelearningRF.plot")
+def plot_predictions(model, output="Coffee_Score_Predicted.png"):
+    filtered_data = model["filtered_data"]
+    encoder = model["encoder"]
+    rf = model["rf"]
 
     plt.figure(figsize=(16, 10))
-    age_groups = filtered_data["Age Group"].cat.categories
+    # Only the age groups the encoder was fitted on can be predicted, in survey order
+    fitted = set(encoder.categories_[0])
+    age_groups = [age_group for age_group in filtered_data["Age Group"].cat.categories if age_group in fitted]
     colors = plt.cm.tab10(np.linspace(0, 1, len(age_groups)))
 
+    # Random scaled score inputs with each age group's encoding, every age group predicted in one call
+    encoded_age_groups = encoder.transform(pd.DataFrame({"Age Group": age_groups}))
+    random_inputs = np.random.uniform(0, 1, size=(len(age_groups) * RANDOM_INPUTS,
+                                                  model["n_features"] - encoded_age_groups.shape[1]))
+    random_inputs = np.hstack([random_inputs, np.repeat(encoded_age_groups, RANDOM_INPUTS, axis=0)])
+    all_predicted_scores = rf.predict(random_inputs).reshape(len(age_groups), RANDOM_INPUTS)
+
     # Plot original data and predictions separately f
     for i, age_group in enumerate(age_groups):
         plt.subplot(2, 4, i + 1) 
@@ -104,11 +127,7 @@ def main():
         )
         plt.text(age_group, actual_avg, f"{actual_avg:.2f}", color="blue", fontsize=10)
 
-        # Generate predictions for this age group
-        encoded_age_group = encoder.transform([[age_group]])
-        random_inputs = np.random.uniform(0, 1, size=(200, X_scaled.shape[1] - encoded_age_group.shape[1]))
-        random_inputs = np.hstack([random_inputs, np.tile(encoded_age_group, (200, 1))])
-        predicted_scores = rf.predict(random_inputs)
+        predicted_scores = all_predicted_scores[i]
 
         plt.scatter(
             [f"Predicted {age_group}"] * len(predicted_scores),
@@ -132,11 +151,144 @@ def main():
         plt.legend()
 
     plt.tight_layout()
-    plt.savefig("Coffee_Score_Predicted.png", format="png", dpi=300)
-    train_score = rf.score(X_train, y_train)
-    test_score = rf.score(X_test, y_test)
-    print(f"Training Score: {train_score:.4f}")
-    print(f"Validation Score: {test_score:.4f}")
+    with stage("machinelearningRF.savefig"):
+        plt.savefig(output, format="png", dpi=300)
+    plt.close()
+
+def save_model(model, path):
+    # The fitted encoder, scaler and forest are saved together as one versioned artifact.
+    # Saved uncompressed so predict.py can memory-map the tree arrays instead of reading them in.
+    artifact = {
+        "format": MODEL_FORMAT,
+        "sklearn_version": sklearn.__version__,
+        "columns": COLUMNS,
+        "scheme": model["scheme"],
+        "encoder": model["encoder"],
+        "scaler": model["scaler"],
+        "rf": model["rf"],
+        "train_score": model["train_score"],
+        "test_score": model["test_score"],
+    }
+    joblib.dump(artifact, path)
+
+def load_model(path, mmap_mode="r"):
+    artifact = joblib.load(path, mmap_mode=mmap_mode)
+    if artifact.get("format") != MODEL_FORMAT:
+        raise ValueError(f"{path} is model format {artifact.get('format')}, expected {MODEL_FORMAT}")
+    if artifact["sklearn_version"] != sklearn.__version__:
+        print(f"Warning: {path} was saved with scikit-learn {artifact['sklearn_version']}, "
+              f"running {sklearn.__version__}")
+    return artifact
+
+def report(model):
+    print(f"Training Score: {model['train_score']:.4f}")
+    print(f"Validation Score: {model['test_score']:.4f}")
+
+# The preprocessed features and fold splits, set once per search worker instead of once per task
+search_data = {}
+
+def init_search_worker(X, y, splits):
+    search_data["X"] = X
+    search_data["y"] = y
+    search_data["splits"] = splits
+
+@profiled("machinelearningRF.fit_fold")
+def fit_fold(params, fold):
+    train_index, test_index = search_data["splits"][fold]
+    X, y = search_data["X"], search_data["y"]
+
+    start = time.perf_counter()
+    rf = RandomForestRegressor(random_state=42, n_jobs=1, **params)
+    rf.fit(X[train_index], y[train_index])
+    fit_seconds = time.perf_counter() - start
+
+    return {
+        "fold": fold,
+        "train_score": rf.score(X[train_index], y[train_index]),
+        "validation_score": rf.score(X[test_index], y[test_index]),
+        "fit_seconds": fit_seconds,
+    }
+
+def param_grid(n_estimators, max_depth, max_features):
+    keys = ["n_estimators", "max_depth", "max_features"]
+    return [dict(zip(keys, values)) for values in itertools.product(n_estimators, max_depth, max_features)]
+
+@profiled("machinelearningRF.search")
+def cross_validate(X, y, grid, folds=5, jobs=None):
+    # Every (parameters, fold) pair is fitted in its own worker process; the splits are shared by all of them
+    splits = list(KFold(n_splits=folds, shuffle=True, random_state=42).split(X))
+    tasks = [(params, fold) for params in grid for fold in range(folds)]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_search_worker, initargs=(X, y, splits)) as pool:
+        results = list(pool.map(fit_fold, *zip(*tasks)))
+
+    # The parameters are shown as text (None would not group); grid_index finds the original parameters
+    rows = []
+    for (params, fold), result in zip(tasks, results):
+        rows.append({"grid_index": grid.index(params), **{key: str(value) for key, value in params.items()}, **result})
+    return pd.DataFrame(rows)
+
+def summarise_search(fold_results):
+    keys = ["grid_index", "n_estimators", "max_depth", "max_features"]
+    summary = fold_results.groupby(keys, sort=False).agg(
+        mean_validation_score=("validation_score", "mean"),
+        std_validation_score=("validation_score", "std"),
+        mean_train_score=("train_score", "mean"),
+        total_fit_seconds=("fit_seconds", "sum"),
+    )
+    return summary.sort_values("mean_validation_score", ascending=False)
+
+def parse_max_depth(value):
+    return None if value == "None" else int(value)
+
+def parse_max_features(value):
+    if value in ("sqrt", "log2"):
+        return value
+    return float(value) if "." in value else int(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Random forest prediction of the Combined Score")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--cv", type=int, default=None, metavar="K",
+                        help="run K-fold cross-validation over the parameter grid before training")
+    parser.add_argument("--n-estimators", type=int, nargs="+", default=[100])
+    parser.add_argument("--max-depth", type=parse_max_depth, nargs="+", default=[None])
+    parser.add_argument("--max-features", type=parse_max_features, nargs="+", default=[1.0])
+    parser.add_argument("--jobs", type=int, default=None, help="search worker processes (default: all cores)")
+    parser.add_argument("--save-model", default=None, metavar="PATH",
+                        help="save the fitted encoder, scaler and forest for predict.py")
+    args = parser.parse_args()
+
+    # Load only the relevant columns
+    file_path = args.file_path
+    try:
+        data = load_survey(file_path, COLUMNS)
+    except FileNotFoundError:
+        print(f"Error: File not found at {file_path}")
+        sys.exit(1)
+
+    params = None
+    if args.cv:
+        features = build_features(data)
+        grid = param_grid(args.n_estimators, args.max_depth, args.max_features)
+        fold_results = cross_validate(features["X"], features["y"], grid, args.cv, args.jobs)
+        summary = summarise_search(fold_results)
+
+        print("Cross-validation by fold:")
+        print(fold_results.to_string(index=False))
+        print("Cross-validation summary:")
+        print(summary.to_string())
+
+        # Train the final model with the best parameters
+        params = grid[summary.index[0][0]]
+        print(f"Best parameters: {params}")
+
+    model = train_model(data, params=params)
+    plot_predictions(model)
+    report(model)
+    if args.save_model:
+        save_model(model, args.save_model)
+        print(f"Model saved to {args.save_model}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,143 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from loader import load_survey, read_header, is_checkbox, AGE
+
+# Multi-select questions: group name -> question. Each option is its own checkbox column "<question> (<option>)".
+MULTISELECT_GROUPS = {
+    "where": "Where do you typically drink coffee?",
+    "brewing": "How do you brew coffee at home?",
+    "purchase": "On the go, where do you typically purchase coffee?",
+    "additions": "Do you usually add anything to your coffee?",
+    "dairy": "What kind of dairy do you add?",
+    "sweetener": "What kind of sugar or sweetener do you add?",
+    "flavorings": "What kind of flavorings do you add?",
+    "why": "Why do you drink coffee?",
+}
+
+# Every answer pattern of a group gets a counter, so groups are limited to 2^16 patterns
+MAX_OPTIONS = 16
+
+
+def group_columns(header, group):
+    question = MULTISELECT_GROUPS.get(group, group)
+    return [column for column in header if column.startswith(question + " (") and is_checkbox(column, header)]
+
+
+def option_labels(columns):
+    # "How do you brew coffee at home? (Pour over)" -> "Pour over"
+    return [column[column.index("? (") + 3:-1] for column in columns]
+
+
+def mask_dtype(n_options):
+    if n_options > MAX_OPTIONS:
+        raise ValueError(f"A multi-select group can have at most {MAX_OPTIONS} options, got {n_options}")
+    return np.uint8 if n_options <= 8 else np.uint16
+
+
+def pack(data, columns):
+    # One integer per respondent with bit j set when option j was ticked, and whether the question was answered.
+    # A respondent who skipped the question has no ticked options, so mask 0.
+    masks = np.zeros(len(data), dtype=mask_dtype(len(columns)))
+    answered = np.ones(len(data), dtype=bool)
+    for bit, column in enumerate(columns):
+        values = data[column]
+        answered &= values.notna().to_numpy()
+        masks |= values.fillna(False).to_numpy(dtype=bool).astype(masks.dtype) << bit
+    return masks, answered
+
+
+def bits_matrix(n_options):
+    # (2^k x k) 0/1 matrix: row p holds the options of pattern p
+    patterns = np.arange(2 ** n_options)
+    return ((patterns[:, None] >> np.arange(n_options)) & 1).astype(np.int64)
+
+
+def popcount(masks, n_options):
+    # Options ticked per respondent, from a lookup table over every pattern
+    return bits_matrix(n_options).sum(axis=1)[masks]
+
+
+def pattern_counts(masks, n_options, segments=None, n_segments=1, answered=None, weights=None):
+    # Respondents (or their summed survey weights) per (segment, answer pattern) from a single bincount;
+    # every count below is derived from it
+    masks = np.asarray(masks, dtype=np.int64)
+    codes = np.zeros(len(masks), dtype=np.int64) if segments is None else np.asarray(segments, dtype=np.int64)
+    keep = codes >= 0
+    if answered is not None:
+        keep &= answered
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)[keep]
+    flat = np.bincount(codes[keep] * 2 ** n_options + masks[keep], weights=weights,
+                       minlength=n_segments * 2 ** n_options)
+    return flat.reshape(n_segments, 2 ** n_options)
+
+
+def option_counts(patterns, n_options):
+    # Respondents who ticked each option, per segment
+    return patterns @ bits_matrix(n_options)
+
+
+def co_occurrence(patterns, n_options):
+    # (segments x k x k) respondents who ticked both options; the diagonal is option_counts
+    bits = bits_matrix(n_options)
+    return np.einsum("sp,pi,pj->sij", patterns, bits, bits)
+
+
+def combinations(patterns, labels, segment_labels=None, top=10):
+    # The most common answer patterns of each segment, with their share of the segment's respondents
+    bits = bits_matrix(len(labels)).astype(bool)
+    names = [" + ".join(np.asarray(labels)[bits[pattern]]) or "(none)" for pattern in range(len(bits))]
+    segment_labels = list(segment_labels) if segment_labels is not None else list(range(len(patterns)))
+
+    rows = []
+    for segment, counts in zip(segment_labels, patterns):
+        total = counts.sum()
+        for pattern in np.argsort(-counts, kind="stable")[:top]:
+            if counts[pattern] == 0:
+                break
+            rows.append({"Segment": segment, "Combination": names[pattern], "Options": int(bits[pattern].sum()),
+                         "Respondents": int(counts[pattern]), "Share": counts[pattern] / total})
+    return pd.DataFrame(rows, columns=["Segment", "Combination", "Options", "Respondents", "Share"])
+
+
+def group_patterns(data, columns, segment):
+    # Pattern counts of the answered respondents per category of a categorical segment column
+    masks, answered = pack(data, columns)
+    segment_values = data[segment].astype("category")
+    categories = segment_values.cat.categories
+    patterns = pattern_counts(masks, len(columns), segment_values.cat.codes.to_numpy(), len(categories), answered)
+    return categories, patterns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Combinations of the options of a multi-select question")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--group", default="brewing", help=f"one of {', '.join(MULTISELECT_GROUPS)} or a question")
+    parser.add_argument("--by", default=AGE, help="column the respondents are split by (default: age group)")
+    parser.add_argument("--top", type=int, default=5, help="combinations shown per segment")
+    args = parser.parse_args()
+
+    try:
+        columns = group_columns(read_header(args.file_path), args.group)
+        if not columns:
+            print(f"Error: No checkbox columns for {args.group}")
+            sys.exit(1)
+        data = load_survey(args.file_path, [args.by] + columns)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    labels = option_labels(columns)
+    categories, patterns = group_patterns(data, columns, args.by)
+
+    print(f"Most common combinations by {args.by}:")
+    print(combinations(patterns, labels, categories, args.top).to_string(index=False))
+
+    print("\nRespondents ticking both options (all segments):")
+    print(pd.DataFrame(co_occurrence(patterns.sum(axis=0, keepdims=True), len(labels))[0],
+                       index=labels, columns=labels).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from profiling import profiled
+
+# Permutations drawn per batch; each batch is one task with its own seed
+BATCH_SIZE = 10000
+
+
+def expected_counts(observed):
+    observed = np.asarray(observed, dtype=np.float64)
+    return np.outer(observed.sum(axis=1), observed.sum(axis=0)) / observed.sum()
+
+
+def chi2_statistics(tables, expected):
+    # Pearson chi-square of every table in a (permutations x rows x columns) stack at once
+    return ((tables - expected) ** 2 / expected).sum(axis=(-2, -1))
+
+
+def random_tables(row_totals, column_totals, size, rng):
+    # Tables with the observed margins, distributed exactly as the table of a random shuffle of the
+    # column labels against the row labels. Each cell is drawn from its conditional hypergeometric
+    # distribution for all permutations at once, so the cost does not depend on the number of respondents.
+    n_rows, n_columns = len(row_totals), len(column_totals)
+    tables = np.zeros((size, n_rows, n_columns), dtype=np.int64)
+    remaining = np.tile(np.asarray(column_totals, dtype=np.int64), (size, 1))
+
+    for i in range(n_rows - 1):
+        left = np.full(size, row_totals[i], dtype=np.int64)
+        pool = remaining.sum(axis=1)
+        for j in range(n_columns - 1):
+            pool -= remaining[:, j]
+            drawn = rng.hypergeometric(remaining[:, j], pool, left)
+            tables[:, i, j] = drawn
+            left -= drawn
+        tables[:, i, -1] = left
+        remaining -= tables[:, i]
+    tables[:, -1] = remaining
+    return tables
+
+
+def count_extreme(observed, size, seed):
+    # Number of permuted tables whose statistic is at least the observed one
+    observed = np.asarray(observed, dtype=np.int64)
+    expected = expected_counts(observed)
+    statistic = chi2_statistics(observed, expected)
+
+    rng = np.random.default_rng(seed)
+    tables = random_tables(observed.sum(axis=1), observed.sum(axis=0), size, rng)
+    # Small tolerance so permutations that reproduce the observed table count as extreme
+    return int((chi2_statistics(tables, expected) >= statistic * (1 - 1e-9)).sum())
+
+
+@profiled("permutation.test")
+def permutation_test(observed, permutations=100000, seed=0, jobs=1, batch_size=BATCH_SIZE):
+    # Monte Carlo permutation chi-square test. Batches get child seeds of one SeedSequence,
+    # so the result for a given seed is the same whatever the number of worker processes.
+    observed = np.asarray(observed, dtype=np.int64)
+    observed = observed[observed.sum(axis=1) > 0][:, observed.sum(axis=0) > 0]
+
+    sizes = [batch_size] * (permutations // batch_size)
+    if permutations % batch_size:
+        sizes.append(permutations % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if jobs == 1:
+        extreme = sum(count_extreme(observed, size, child) for size, child in zip(sizes, seeds))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            extreme = sum(pool.map(count_extreme, [observed] * len(sizes), sizes, seeds))
+
+    # The observed table counts as one of the permutations, so the p-value is never exactly zero
+    p_value = (extreme + 1) / (permutations + 1)
+    p_hat = extreme / permutations
+    return {
+        "statistic": float(chi2_statistics(observed, expected_counts(observed))),
+        "p_value": p_value,
+        "standard_error": float(np.sqrt(p_hat * (1 - p_hat) / permutations)),
+        "permutations": permutations,
+    }
@@ -0,0 +1,163 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import matplotlib
+matplotlib.use("Agg")
+import coffeeScore
+import cupcomp
+import demographics
+import machinelearningRF
+import statTest
+import weighting
+from artifacts import MAX_BYTES, default_cache_dir, data_hash, artifact_key, load_value, restore_file, store, evict
+from loader import load_survey, AGE
+from store import WAVE
+from scoring import DEFAULT_SCHEME
+
+# Analysis stages: name -> (function, stages whose results it takes). "data" is the loaded survey.
+# The survey weights are computed once and shared by every aggregate.
+# The forest is listed last so the other figures are already rendering while it trains.
+STAGES = {
+    "weights": (weighting.survey_weights, ["data"]),
+    "scores_by_age": (coffeeScore.score_by_age, ["data", "weights"]),
+    "scores_by_cups": (cupcomp.score_by_cups, ["data", "weights"]),
+    "stat_tables": (statTest.build_tables, ["data", "weights"]),
+    "rf_model": (machinelearningRF.train_model, ["data"]),
+}
+
+# Figure renders: output file -> (render function, stage it draws, key inside that stage's result)
+FIGURES = {
+    "age_distribution.png": (demographics.plot_age_distribution, "data", None),
+    "Coffee_Score": (coffeeScore.plot_scores, "scores_by_age", None),
+    "Cup_Comparison.png": (cupcomp.plot_cups, "scores_by_cups", None),
+    "coffee_preference_by_age.png": (statTest.plot_preference_heatmap, "stat_tables", "preference"),
+    "coffee_consumption_by_age.png": (statTest.plot_consumption, "stat_tables", "consumption"),
+    "most_popular_brewing_by_age.png": (statTest.plot_most_popular, "stat_tables", "brewing_totals"),
+    "least_popular_brewing_by_age.png": (statTest.plot_least_popular, "stat_tables", "brewing_totals"),
+    "brewing_method_by_age.png": (statTest.plot_brewing_heatmap, "stat_tables", "brewing"),
+    "Coffee_Score_Predicted.png": (machinelearningRF.plot_predictions, "rf_model", None),
+}
+
+# Every column any stage reads, so the survey is loaded a single time
+COLUMNS = list(dict.fromkeys(
+    demographics.COLUMNS + coffeeScore.COLUMNS + cupcomp.COLUMNS + statTest.COLUMNS + machinelearningRF.COLUMNS
+    + weighting.COLUMNS
+))
+
+
+def no_weights(data):
+    # Stands in for the weights stage of an unweighted run, every respondent counts once
+    return None
+
+
+def topological_order(stages):
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order or name not in stages:
+            return
+        if name in visiting:
+            raise ValueError(f"Stage dependency cycle at {name}")
+        visiting.add(name)
+        for dependency in stages[name][1]:
+            visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+def input_keys(function, dependencies, data, keys):
+    # Cache keys of a function's inputs: "data" stands for the columns its module reads, a stage for its key
+    return [data_hash(data, sys.modules[function.__module__].COLUMNS) if dependency == "data" else keys[dependency]
+            for dependency in dependencies]
+
+
+def submit_figures(pool, stage, result, output_dir, data=None, keys=None, cache_dir=None):
+    # Figures whose key is cached are copied into place instead of being rendered
+    futures = {}
+    for output, (render, source, key) in FIGURES.items():
+        if source != stage:
+            continue
+        path = os.path.join(output_dir, output)
+        figure_key = None
+        if cache_dir is not None:
+            figure_key = artifact_key(output, render, input_keys(render, [source], data, keys), {"key": key})
+            if restore_file(cache_dir, figure_key, path):
+                continue
+        argument = result if key is None else result[key]
+        futures[pool.submit(render, argument, path)] = (path, figure_key)
+    return futures
+
+
+def run(data, jobs=None, output_dir=".", cache_dir=None, max_bytes=MAX_BYTES, weighted=True):
+    # Stages run in this process in dependency order; each figure goes to the pool as soon as its stage is done.
+    # With a cache directory, stages and figures whose data, code and parameters are unchanged are not rerun.
+    stages = dict(STAGES)
+    if not weighted:
+        stages["weights"] = (no_weights, ["data"])
+    results = {"data": data}
+    keys = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = submit_figures(pool, "data", data, output_dir, data, keys, cache_dir)
+        for name in topological_order(stages):
+            function, dependencies = stages[name]
+            results[name] = None
+            if cache_dir is not None:
+                keys[name] = artifact_key(name, function, input_keys(function, dependencies, data, keys),
+                                          {"scheme": DEFAULT_SCHEME})
+                results[name] = load_value(cache_dir, keys[name])
+            if results[name] is None:
+                results[name] = function(*[results[dependency] for dependency in dependencies])
+                if cache_dir is not None:
+                    store(cache_dir, keys[name], results[name], max_bytes=max_bytes)
+            futures.update(submit_figures(pool, name, results[name], output_dir, data, keys, cache_dir))
+
+        for future in as_completed(futures):
+            future.result()
+            path, figure_key = futures[future]
+            if cache_dir is not None:
+                store(cache_dir, figure_key, files=[path], max_bytes=max_bytes)
+    if cache_dir is not None:
+        # Also applies a limit lowered since the entries were stored
+        evict(cache_dir, max_bytes)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every analysis from a single load of the survey")
+    parser.add_argument("file_path", help="path to the survey CSV or a store directory (see store.py)")
+    parser.add_argument("--wave", nargs="+", default=None, help="only these waves of a store")
+    parser.add_argument("--age", nargs="+", default=None, help="only these age groups")
+    parser.add_argument("--jobs", type=int, default=None, help="figure render processes (default: all cores)")
+    parser.add_argument("--output-dir", default=".", help="directory the figures are written to")
+    parser.add_argument("--cache-dir", default=None,
+                        help="artifact cache (default: .survey_cache/artifacts next to the CSV)")
+    parser.add_argument("--cache-size", type=int, default=MAX_BYTES // 2 ** 20, help="artifact cache limit in MB")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage and figure")
+    parser.add_argument("--unweighted", action="store_true", help="count every respondent equally")
+    args = parser.parse_args()
+
+    filters = {column: values for column, values in ((WAVE, args.wave), (AGE, args.age)) if values}
+    try:
+        data = load_survey(args.file_path, COLUMNS, filters=filters)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+    except KeyError as error:
+        print(f"Error: {error.args[0]}")
+        sys.exit(1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache_dir = None if args.no_cache else args.cache_dir or default_cache_dir(args.file_path)
+    results = run(data, args.jobs, args.output_dir, cache_dir, args.cache_size * 2 ** 20, not args.unweighted)
+
+    statTest.report(results["stat_tables"])
+    machinelearningRF.report(results["rf_model"])
+
+if __name__ == "__main__":
+    main()
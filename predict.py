@@ -0,0 +1,95 @@
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from loader import read_chunks, SUBMISSION_ID
+from machinelearningRF import load_model, score_rows, feature_matrix
+from profiling import profiled
+
+# Columns of the predictions CSV
+PREDICTION_COLUMNS = [SUBMISSION_ID, "Predicted Score"]
+
+# The artifact a prediction worker loaded, once per process
+worker_model = {}
+
+
+def init_worker(model_path):
+    worker_model.update(load_model(model_path))
+    # The pool already spreads chunks over the cores
+    worker_model["rf"].n_jobs = 1
+
+
+@profiled("predict.chunk")
+def predict_chunk(chunk, model=None):
+    # Score, encode and scale a whole chunk at once, then predict it in one call
+    if model is None:
+        model = worker_model
+    filtered_data = score_rows(chunk, model["scheme"])
+    predictions = pd.Series(np.nan, index=chunk.index)
+    if len(filtered_data):
+        X = model["scaler"].transform(feature_matrix(filtered_data, model["encoder"]))
+        predictions[filtered_data.index] = model["rf"].predict(X)
+    return pd.DataFrame({SUBMISSION_ID: chunk[SUBMISSION_ID].astype(str).to_numpy(),
+                         "Predicted Score": predictions.to_numpy()}, columns=PREDICTION_COLUMNS)
+
+
+def write_header(output):
+    # Written before any chunk, so an input without scorable rows still replaces the previous output
+    pd.DataFrame(columns=PREDICTION_COLUMNS).to_csv(output, index=False)
+
+
+def write_predictions(predictions, output):
+    predictions[PREDICTION_COLUMNS].to_csv(output, mode="a", header=False, index=False)
+
+
+def predict_file(model_path, file_path, output, chunksize=100000, jobs=1):
+    # Stream the CSV chunk by chunk and append each chunk's predictions to the output in input order
+    model = load_model(model_path)
+    chunks = read_chunks(file_path, [SUBMISSION_ID] + model["columns"], chunksize)
+    written = 0
+    write_header(output)
+
+    if jobs == 1:
+        for chunk in chunks:
+            predictions = predict_chunk(chunk, model)
+            write_predictions(predictions, output)
+            written += len(predictions)
+        return written
+
+    # At most two chunks per worker are in flight, so memory stays bounded however large the file is
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(model_path,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(predict_chunk, chunk))
+            if len(pending) >= 2 * (jobs or os.cpu_count()):
+                predictions = pending.popleft().result()
+                write_predictions(predictions, output)
+                written += len(predictions)
+        while pending:
+            predictions = pending.popleft().result()
+            write_predictions(predictions, output)
+            written += len(predictions)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a survey CSV with a model saved by machinelearningRF.py")
+    parser.add_argument("model_path", help="artifact written by machinelearningRF.py --save-model")
+    parser.add_argument("file_path", help="CSV with the responses to score")
+    parser.add_argument("output", help="CSV the predictions are written to")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows scored per chunk")
+    parser.add_argument("--jobs", type=int, default=1, help="prediction worker processes (0 for all cores)")
+    args = parser.parse_args()
+
+    try:
+        written = predict_file(args.model_path, args.file_path, args.output, args.chunksize, args.jobs or None)
+    except FileNotFoundError as error:
+        print(f"Error: File not found at {error.filename or error}")
+        sys.exit(1)
+    print(f"Wrote {written} predictions to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows has no getrusage, peak RSS is then not recorded
+    resource = None
+
+# COFFEE_PROFILE=1 times every stage, COFFEE_PROFILE=cprofile also dumps a cProfile per stage.
+# Unset (the default), stage() and profiled() cost nothing.
+MODE = os.environ.get("COFFEE_PROFILE", "").lower()
+ENABLED = MODE not in ("", "0", "off", "false")
+PROFILE_DIR = os.environ.get("COFFEE_PROFILE_DIR", "profile")
+
+# Shared by the processes of one run (figure and search workers inherit it), so all their stages
+# land in the same events file
+RUN_ID = os.environ.get("COFFEE_PROFILE_RUN")
+OWNER = ENABLED and RUN_ID is None
+if OWNER:
+    RUN_ID = f"{int(time.time())}-{os.getpid()}"
+    os.environ["COFFEE_PROFILE_RUN"] = RUN_ID
+
+DISABLED = contextlib.nullcontext()
+
+# Open stages of this process, innermost last
+open_stages = []
+
+
+def events_path():
+    return os.path.join(PROFILE_DIR, f"events-{RUN_ID}.jsonl")
+
+
+def peak_rss():
+    # Process high-water mark in bytes (ru_maxrss is KiB on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def file_name(name):
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.peak = 0
+        self.profiler = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # The enclosing stage keeps the peak reached so far before it is reset for this one
+        _, peak = tracemalloc.get_traced_memory()
+        if open_stages:
+            open_stages[-1].peak = max(open_stages[-1].peak, peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+        # Only one profiler can be active, so nested stages are covered by the outermost profile
+        if MODE == "cprofile" and not any(stage.profiler for stage in open_stages):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        open_stages.append(self)
+        self.timestamp = time.time()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        open_stages.pop()
+
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        if open_stages:
+            open_stages[-1].peak = max(open_stages[-1].peak, self.peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, f"{file_name(self.name)}-{os.getpid()}.prof"))
+
+        # One line per stage, appended in a single write so worker processes never interleave
+        event = {
+            "name": self.name, "pid": os.getpid(), "depth": len(open_stages),
+            "start": self.timestamp, "wall": wall, "cpu": cpu,
+            "peak_traced": self.peak, "peak_rss": peak_rss(),
+        }
+        with open(events_path(), "a", encoding="utf-8") as f:
+            f.write(json.dumps(event) + "\n")
+        return False
+
+
+def stage(name):
+    # Times a block as a named stage: wall and CPU time, peak traced allocations and peak RSS
+    if not ENABLED:
+        return DISABLED
+    return Stage(name)
+
+
+def profiled(name):
+    # Decorator form of stage(); returns the function itself when profiling is off
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def read_events(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def chrome_trace(events):
+    # Complete ("X") events for chrome://tracing or Perfetto, one track per process
+    return {
+        "displayTimeUnit": "ms",
+        "traceEvents": [{
+            "name": event["name"], "ph": "X", "pid": event["pid"], "tid": 0,
+            "ts": event["start"] * 1e6, "dur": event["wall"] * 1e6,
+            "args": {"cpu_ms": event["cpu"] * 1e3, "peak_traced_bytes": event["peak_traced"],
+                     "peak_rss_bytes": event["peak_rss"]},
+        } for event in events],
+    }
+
+
+def summary(events):
+    # Per stage: calls, total wall and CPU seconds, largest traced peak and RSS in MiB
+    totals = {}
+    for event in events:
+        total = totals.setdefault(event["name"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "traced": 0, "rss": 0})
+        total["calls"] += 1
+        total["wall"] += event["wall"]
+        total["cpu"] += event["cpu"]
+        total["traced"] = max(total["traced"], event["peak_traced"])
+        total["rss"] = max(total["rss"], event["peak_rss"] or 0)
+
+    width = max([len(name) for name in totals] + [5])
+    lines = [f"{'stage':<{width}} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'traced MiB':>11} {'rss MiB':>9}"]
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]["wall"]):
+        lines.append(f"{name:<{width}} {total['calls']:>6} {total['wall']:>9.3f} {total['cpu']:>9.3f} "
+                     f"{total['traced'] / 2 ** 20:>11.1f} {total['rss'] / 2 ** 20:>9.1f}")
+    return "\n".join(lines)
+
+
+def finish():
+    # Run by the process that started profiling: merge every process's stages into one trace
+    events = read_events(events_path())
+    if not events:
+        return
+    trace_path = os.path.join(PROFILE_DIR, f"trace-{RUN_ID}.json")
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump(chrome_trace(events), f)
+    os.remove(events_path())
+    print(summary(events), file=sys.stderr)
+    print(f"Profile trace saved to {trace_path}", file=sys.stderr)
+
+
+if OWNER:
+    atexit.register(finish)
@@ -0,0 +1,182 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from loader import load_survey
+from machinelearningRF import COLUMNS, SCORE_FEATURES, train_model, load_model, score_rows, feature_matrix
+from profiling import profiled, stage
+
+FEATURES = SCORE_FEATURES + ["Age Group"]
+
+# Short names used on the command line
+FEATURE_NAMES = {"taste": "Taste Score", "strength": "Strength Score", "roast": "Roast Score", "age": "Age Group"}
+
+# ICE curves drawn per feature in the partial dependence figure
+ICE_CURVES = 100
+
+
+def default_values(respondents, feature):
+    # Every observed score, or every age group in survey order
+    if feature == "Age Group":
+        return list(respondents[feature].cat.categories)
+    return sorted(respondents[feature].dropna().unique())
+
+
+def scenario_grid(respondents, grid=None):
+    # Every combination of the grid's values; features left out of the grid take their observed values
+    grid = grid or {}
+    axes = [list(grid[feature]) if feature in grid else default_values(respondents, feature) for feature in FEATURES]
+    return pd.MultiIndex.from_product(axes, names=FEATURES).to_frame(index=False)
+
+
+def design_matrix(model, scenarios):
+    # Scaled model inputs of every scenario, encoded and scaled in one pass
+    return model["scaler"].transform(feature_matrix(scenarios, model["encoder"]))
+
+
+def predict(model, X, jobs=None):
+    # A single predict call over every row, the trees spread over jobs threads (None keeps the model's setting)
+    rf = model["rf"]
+    if jobs is None:
+        return rf.predict(X)
+    n_jobs = rf.n_jobs
+    rf.n_jobs = jobs
+    try:
+        return rf.predict(X)
+    finally:
+        rf.n_jobs = n_jobs
+
+
+@profiled("scenarios.grid")
+def predict_grid(model, respondents, grid=None, jobs=None):
+    scenarios = scenario_grid(respondents, grid)
+    with stage("scenarios.predict"):
+        scenarios["Predicted Score"] = predict(model, design_matrix(model, scenarios), jobs)
+    return scenarios
+
+
+@profiled("scenarios.partial_dependence")
+def partial_dependence(model, respondents, features=FEATURES, grid=None, jobs=None):
+    # ICE: every respondent's prediction with one feature set to each grid value; partial dependence is their mean.
+    # The respondents are encoded once, every (feature, value) copy is stacked and predicted in one call.
+    grid = grid or {}
+    base = feature_matrix(respondents, model["encoder"])
+    n_scores = len(SCORE_FEATURES)
+
+    values, blocks = {}, []
+    for feature in features:
+        values[feature] = list(grid[feature]) if feature in grid else default_values(respondents, feature)
+        copies = np.repeat(base[None], len(values[feature]), axis=0)
+        if feature == "Age Group":
+            encoded = model["encoder"].transform(pd.DataFrame({feature: values[feature]}))
+            copies[:, :, n_scores:] = encoded[:, None, :]
+        else:
+            copies[:, :, SCORE_FEATURES.index(feature)] = np.asarray(values[feature], dtype=np.float64)[:, None]
+        blocks.append(copies.reshape(-1, base.shape[1]))
+
+    with stage("scenarios.predict"):
+        predictions = predict(model, model["scaler"].transform(np.vstack(blocks)), jobs)
+
+    curves, offset = {}, 0
+    for feature in features:
+        size = len(values[feature]) * len(base)
+        curves[feature] = predictions[offset:offset + size].reshape(len(values[feature]), len(base)).T
+        offset += size
+
+    table = pd.DataFrame([{"Feature": feature, "Value": value, "Partial Dependence": curves[feature][:, i].mean(),
+                           "ICE Std": curves[feature][:, i].std()}
+                          for feature in features for i, value in enumerate(values[feature])])
+    return table, values, curves
+
+
+@profiled("scenarios.plot")
+def plot_partial_dependence(values, curves, output="Partial_Dependence.png", ice_curves=ICE_CURVES, seed=0):
+    # One panel per feature: a sample of ICE curves in grey and the partial dependence on top
+    features = list(curves)
+    fig, axes = plt.subplots(1, len(features), figsize=(5 * len(features), 5), sharey=True, squeeze=False)
+    rng = np.random.default_rng(seed)
+    for ax, feature in zip(axes[0], features):
+        ice = curves[feature]
+        sample = rng.choice(len(ice), size=min(ice_curves, len(ice)), replace=False)
+        positions = np.arange(len(values[feature]))
+        ax.plot(positions, ice[sample].T, color="grey", alpha=0.15, linewidth=0.8)
+        ax.plot(positions, ice.mean(axis=0), color="red", marker="o", linewidth=2.5, label="Partial dependence")
+        ax.set_xticks(positions)
+        ax.set_xticklabels([str(value) for value in values[feature]], rotation=30 if feature == "Age Group" else 0,
+                           fontsize=8)
+        ax.set_title(feature)
+        ax.grid(alpha=0.3)
+    axes[0][0].set_ylabel("Predicted Combined Score")
+    axes[0][0].legend()
+    plt.tight_layout()
+    with stage("scenarios.savefig"):
+        plt.savefig(output, format="png", dpi=300)
+    plt.close(fig)
+
+
+def parse_grid(value):
+    # FEATURE=v1,v2,... or, for the scores, FEATURE=start:stop:count evenly spaced values
+    name, separator, values = value.partition("=")
+    if not separator or name not in FEATURE_NAMES:
+        raise argparse.ArgumentTypeError(f"Grids are written FEATURE=VALUES with FEATURE one of "
+                                         f"{', '.join(FEATURE_NAMES)}, got {value}")
+    feature = FEATURE_NAMES[name]
+    if feature == "Age Group":
+        return feature, values.split(",")
+    try:
+        if values.count(":") == 2:
+            start, stop, count = values.split(":")
+            return feature, list(np.linspace(float(start), float(stop), int(count)))
+        return feature, [float(v) for v in values.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Score values must be numbers, got {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="What-if scenarios and partial dependence of the random forest")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("command", choices=["grid", "pdp"])
+    parser.add_argument("--model", default=None, metavar="PATH",
+                        help="model saved by machinelearningRF.py --save-model (default: train one)")
+    parser.add_argument("--grid", type=parse_grid, action="append", default=[], metavar="FEATURE=VALUES",
+                        help="values of one feature, e.g. taste=1:8:50 or age=18-24 years old, can be repeated")
+    parser.add_argument("--jobs", type=int, default=None, help="prediction threads (default: the model's)")
+    parser.add_argument("--output", default=None, help="scenario or partial dependence CSV")
+    parser.add_argument("--plot", default="Partial_Dependence.png", help="partial dependence figure")
+    parser.add_argument("--ice", type=int, default=ICE_CURVES, help="ICE curves drawn per feature")
+    args = parser.parse_args()
+
+    try:
+        data = load_survey(args.file_path, COLUMNS)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    model = load_model(args.model) if args.model else train_model(data)
+    respondents = score_rows(data, model["scheme"])
+    grid = dict(args.grid)
+
+    # The encoder only knows the age groups of the survey
+    unknown = [age for age in grid.get("Age Group", []) if age not in respondents["Age Group"].cat.categories]
+    if unknown:
+        print(f"Error: Unknown age group {', '.join(unknown)}, expected one of "
+              f"{', '.join(respondents['Age Group'].cat.categories)}")
+        sys.exit(1)
+
+    if args.command == "grid":
+        scenarios = predict_grid(model, respondents, grid, args.jobs)
+        output = args.output or "scenarios.csv"
+        scenarios.to_csv(output, index=False)
+        print(f"Predicted {len(scenarios)} scenarios, saved to {output}")
+        best = scenarios.sort_values("Predicted Score", ascending=False)
+        print(best.head(10).to_string(index=False))
+    else:
+        table, values, curves = partial_dependence(model, respondents, FEATURES, grid, args.jobs)
+        output = args.output or "partial_dependence.csv"
+        table.to_csv(output, index=False)
+        plot_partial_dependence(values, curves, args.plot, args.ice)
+        print(table.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import json
+import numpy as np
+import pandas as pd
+from loader import TASTE, STRENGTH, ROAST
+from profiling import profiled
+
+# Define scoring, with sweeter tastes being lesser score and stronger taste being higher score
+taste_scores = {
+    "Fruity": 3, "Chocolatey": 5, "Full-Bodied": 7, "Bright": 4, "Nutty": 6,
+    "Sweet": 2, "Caramalized": 5, "Juicy": 4, "Bold": 8, "Floral": 3, "Complex": 6, "Light": 1
+}
+
+strength_scores = {
+    "Light": 1, "Medium": 3, "Dark": 5, "Nordic": 2, "Blonde": 2, "Italian": 4, "French": 5
+}
+
+roast_scores = {
+    "Somewhat strong": 3, "Medium": 5, "Very strong": 7, "Somewhat light": 2, "Weak": 1
+}
+
+# A scoring scheme maps each scored answer column to its answer -> score dictionary
+DEFAULT_SCHEME = {TASTE: taste_scores, STRENGTH: strength_scores, ROAST: roast_scores}
+
+SCHEMES = {"default": DEFAULT_SCHEME}
+
+SCORE_NAMES = {TASTE: "Taste Score", STRENGTH: "Strength Score", ROAST: "Roast Score"}
+
+
+def load_scheme(path):
+    # A scheme file is JSON of the form {"<answer column>": {"<answer>": <score>, ...}, ...}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def answer_codes(series):
+    # Category codes of an answer column, -1 for a missing answer
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+    return series.cat.codes.to_numpy(), series.cat.categories
+
+
+def lookup_table(categories, scores):
+    # Score per category plus a trailing NaN, so code -1 (missing answer) looks up NaN
+    table = np.full(len(categories) + 1, np.nan)
+    table[:-1] = [scores.get(category, np.nan) for category in categories]
+    return table
+
+
+@profiled("scoring.score")
+def score_schemes(data, schemes):
+    # Score every scheme in one pass: each answer column is coded once, and the scores
+    # of all schemes come from a single index into a (schemes x categories) lookup array
+    names = list(schemes)
+    columns = list(dict.fromkeys(column for name in names for column in schemes[name]))
+
+    totals = np.zeros((len(names), len(data)))
+    counts = np.zeros((len(names), len(data)))
+    column_scores = {}
+    for column in columns:
+        codes, categories = answer_codes(data[column])
+        tables = np.vstack([lookup_table(categories, schemes[name].get(column, {})) for name in names])
+        scores = tables[:, codes]
+        answered = ~np.isnan(scores)
+        totals += np.where(answered, scores, 0)
+        counts += answered
+        column_scores[column] = scores
+
+    # Combined Score is the mean of the answered scores, NaN when none was answered
+    with np.errstate(invalid="ignore"):
+        combined = totals / counts
+
+    results = {}
+    for i, name in enumerate(names):
+        frame = pd.DataFrame({
+            SCORE_NAMES.get(column, f"{column} Score"): column_scores[column][i]
+            for column in columns if column in schemes[name]
+        }, index=data.index)
+        frame["Combined Score"] = combined[i]
+        results[name] = frame
+    return results
+
+
+def score(data, scheme=DEFAULT_SCHEME):
+    return score_schemes(data, {"scheme": scheme})["scheme"]
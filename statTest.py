@@ -1,222 +1,360 @@
+import argparse
+import os
 import sys
+import numpy as np
 import pandas as pd
-from scipy.stats import chi2_contingency
-import seaborn as sns
 import matplotlib.pyplot as plt
+from permutation import permutation_test
+from multiselect import pack, popcount, pattern_counts, option_counts
+from profiling import profiled, stage
+from weighting import survey_weights, table_design_effect, COLUMNS as WEIGHTING_COLUMNS
+from loader import load_survey, read_chunks, AGE, TASTE, CUPS, BREWING_COLUMNS, AGE_ORDER, ORDERED_ANSWERS
 
-if len(sys.argv) != 2:
-    print("Usage: python coffee_preferences.py <path_to_csv>")
-    sys.exit(1)
+COLUMNS = [AGE, TASTE, CUPS] + BREWING_COLUMNS
 
-file_path = sys.argv[1]
-try:
-    data = pd.read_csv(file_path)
-except FileNotFoundError:
-    print(f"Error: File not found at {file_path}")
-    sys.exit(1)
-
-data = pd.read_csv(file_path)
-
-# This section output p-value and heatmap between age group and coffee preferences
+alpha = 0.05
 
-# Drop rows with missing values in these columns
-data = data.dropna(subset=["What is your age?", "Before today's tasting, which of the following best described what kind of coffee you like?"])
+order = AGE_ORDER
 
-# Create a contingency table for Chi-Square test
-contingency_table = pd.crosstab(data["What is your age?"], data["Before today's tasting, which of the following best described what kind of coffee you like?"])
+# Define shorter labels for graph label
+short_labels = {
+    "How do you brew coffee at home? (Pour over)": "Pour Over",
+    "How do you brew coffee at home? (French press)": "French Press",
+    "How do you brew coffee at home? (Espresso)": "Espresso",
+    "How do you brew coffee at home? (Coffee brewing machine (e.g. Mr. Coffee))": "Brewing Machine",
+    "How do you brew coffee at home? (Pod/capsule machine (e.g. Keurig/Nespresso))": "Pod Machine",
+    "How do you brew coffee at home? (Instant coffee)": "Instant Coffee",
+    "How do you brew coffee at home? (Bean-to-cup machine)": "Bean-to-Cup",
+    "How do you brew coffee at home? (Cold brew)": "Cold Brew",
+    "How do you brew coffee at home? (Coffee extract (e.g. Cometeer))": "Coffee Extract",
+    "How do you brew coffee at home? (Other)": "Other"
+}
 
-contingency_table_percentage = contingency_table.div(contingency_table.sum(axis=1), axis=0) * 100
 
-# Perform the Chi-Square test
-chi2 = chi2_contingency(contingency_table)
+@profiled("statTest.tables")
+def build_tables(data, weights=None):
+    # With survey weights (see weighting.py) every table sums the respondents' weights instead of counting them
+    if weights is not None:
+        data = data.assign(Weight=weights)
+
+    # Drop rows with missing values in these columns, every test below runs on the remaining respondents
+    data = data.dropna(subset=[AGE, TASTE])
+
+    # Create a contingency table for Chi-Square test between age group and coffee preferences
+    preference_table = crosstab(data, TASTE)
+
+    # Create a contingency table between age group and coffee consumption frequency
+    age_consumption_data = data.dropna(subset=[AGE, CUPS])
+    consumption_table = crosstab(age_consumption_data, CUPS)
+
+    # The brewing checkboxes are packed into one bitmask per respondent and counted per (age group, pattern),
+    # both brewing tables are derived from those counts
+    brewing = new_counts(order, range(2 ** len(BREWING_COLUMNS)), np.int64 if weights is None else np.float64)
+    brewing_masks = pack(data, BREWING_COLUMNS)[0]
+    add_patterns(brewing, data[AGE], brewing_masks, data.get("Weight"))
+    brewing_totals, brewing_table = brewing_tables(brewing)
+
+    tables = {
+        "preference": preference_table,
+        "consumption": consumption_table,
+        "brewing_totals": brewing_totals,
+        "brewing": brewing_table,
+    }
+    if weights is not None:
+        # Unequal weights make the tests less precise than the respondent count suggests. A respondent adds
+        # one count per ticked method to the brewing table, so its correction treats them as clusters.
+        tables["design_effects"] = {
+            "preference": table_design_effect(data["Weight"]),
+            "consumption": table_design_effect(age_consumption_data["Weight"]),
+            "brewing": table_design_effect(data["Weight"], popcount(brewing_masks, len(BREWING_COLUMNS))),
+        }
+    return tables
+
+
+def crosstab(data, column):
+    if "Weight" not in data.columns:
+        return pd.crosstab(data[AGE], data[column])
+    return pd.crosstab(data[AGE], data[column], values=data["Weight"], aggfunc="sum").fillna(0)
+
+
+def new_counts(rows=(), columns=(), dtype=np.int64):
+    return {"rows": list(rows), "columns": list(columns), "counts": np.zeros((len(rows), len(columns)), dtype=dtype)}
 
-print(f"p-value between age group and coffee preferences: {chi2.pvalue}")
 
-alpha = 0.05
-if chi2.pvalue < alpha:
-    print("Conclusion: There is a significant relationship between age groups and coffee preferences.\n")
-else:
-    print("Conclusion: No significant relationship between age groups and coffee preferences.\n")
+def label_codes(labels, values):
+    # Integer codes of values against a growing label list, adding labels seen for the first time
+    values = pd.Series(values)
+    for label in values.unique():
+        if label not in labels:
+            labels.append(label)
+    return pd.Categorical(values, categories=labels).codes
+
 
-plt.figure(figsize=(10, 6))
-sns.heatmap(contingency_table_percentage, annot=True, cmap="YlGnBu", cbar=True)
+def grow(counts):
+    shape = (len(counts["rows"]), len(counts["columns"]))
+    if counts["counts"].shape != shape:
+        grown = np.zeros(shape, dtype=counts["counts"].dtype)
+        grown[:counts["counts"].shape[0], :counts["counts"].shape[1]] = counts["counts"]
+        counts["counts"] = grown
 
-plt.title("Heatmap of Coffee Preferences by Age Group")
-plt.xlabel("Coffee Preferences (in %)")
-plt.ylabel("Age Groups")
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('coffee_preference_by_age.png', dpi=300)
 
-#plt.show()
-################################################################################################################################
+def add_pairs(counts, row_values, column_values):
+    # Add one chunk's (row, column) pairs into the integer contingency array
+    row_codes = label_codes(counts["rows"], row_values)
+    column_codes = label_codes(counts["columns"], column_values)
+    grow(counts)
+    n_columns = len(counts["columns"])
+    flat = np.bincount(row_codes * n_columns + column_codes, minlength=counts["counts"].size)
+    counts["counts"] += flat.reshape(counts["counts"].shape)
+
+
+def add_patterns(counts, row_values, masks, weights=None):
+    # Add one chunk's multi-select bitmasks into (row label x answer pattern) counts
+    row_codes = label_codes(counts["rows"], row_values)
+    grow(counts)
+    n_options = len(counts["columns"]).bit_length() - 1
+    counts["counts"] += pattern_counts(masks, n_options, row_codes, len(counts["rows"]), weights=weights)
+
+
+def brewing_tables(brewing):
+    # Brewing selections per age group and the age x brewing method contingency table, from pattern counts.
+    # A respondent who skipped the question has no ticked method, so adds nothing to either table.
+    selections = option_counts(brewing["counts"], len(BREWING_COLUMNS))
+    totals = pd.DataFrame(selections, index=pd.Index(brewing["rows"], name=AGE), columns=BREWING_COLUMNS)
+    methods = new_counts(brewing["rows"], [short_labels[column] for column in BREWING_COLUMNS])
+    methods["counts"] = selections
+    return totals.loc[brewing["counts"].sum(axis=1) > 0], to_table(methods, AGE, "Brewing Method", order)
+
 
-# This section output p-value and heatmap between age group and coffee consumption frequency
+def to_table(counts, row_name, column_name, row_order=None, column_order=None):
+    # Same layout pd.crosstab gives: known orders first, other labels sorted, unseen labels dropped
+    table = pd.DataFrame(counts["counts"], index=pd.Index(counts["rows"], name=row_name),
+                         columns=pd.Index(counts["columns"], name=column_name))
+    table = table.loc[table.sum(axis=1) > 0, table.sum(axis=0) > 0]
+    rows = [label for label in row_order if label in table.index] if row_order else sorted(table.index)
+    columns = [label for label in column_order if label in table.columns] if column_order else sorted(table.columns)
+    return table.loc[rows, columns]
 
-# Drop rows with missing values in relevant columns
-age_consumption_data = data.dropna(subset=["What is your age?", "How many cups of coffee do you typically drink per day?"])
 
-# Create a contingency table
-contingency_table = pd.crosstab(age_consumption_data["What is your age?"], age_consumption_data["How many cups of coffee do you typically drink per day?"])
+def new_table_counts():
+    return {
+        "preference": new_counts(order),
+        "consumption": new_counts(order),
+        "brewing": new_counts(order, range(2 ** len(BREWING_COLUMNS))),
+    }
+
+
+def add_chunk(table_counts, chunk):
+    # Add one chunk of respondents into the running contingency counts
+    chunk = chunk.dropna(subset=[AGE, TASTE])
+    add_pairs(table_counts["preference"], chunk[AGE], chunk[TASTE].astype(str))
+
+    answered = chunk.dropna(subset=[CUPS])
+    add_pairs(table_counts["consumption"], answered[AGE], answered[CUPS].astype(str))
+
+    add_patterns(table_counts["brewing"], chunk[AGE], pack(chunk, BREWING_COLUMNS)[0])
+
+
+def finish_tables(table_counts):
+    # Turn the running counts into the same tables build_tables returns
+    brewing_totals, brewing_table = brewing_tables(table_counts["brewing"])
 
-order = ['<18 years old', '18-24 years old', '25-34 years old', '35-44 years old', '45-54 years old', '55-64 years old', '>65 years old']
+    return {
+        "preference": to_table(table_counts["preference"], AGE, TASTE, order),
+        "consumption": to_table(table_counts["consumption"], AGE, CUPS, order, ORDERED_ANSWERS[CUPS]),
+        "brewing_totals": brewing_totals,
+        "brewing": brewing_table,
+    }
 
-contingency_table_percentage = contingency_table.div(contingency_table.sum(axis=1), axis=0) * 100
 
-contingency_table_percentage = contingency_table_percentage.reindex(order)
+@profiled("statTest.tables")
+def build_tables_chunked(file_path, chunksize=100000):
+    # Same tables as build_tables, accumulated chunk by chunk so memory stays flat for any file size.
+    # Always unweighted: raking needs every respondent's answers before the first chunk is counted.
+    table_counts = new_table_counts()
+    for chunk in read_chunks(file_path, COLUMNS, chunksize):
+        add_chunk(table_counts, chunk)
+    return finish_tables(table_counts)
 
-# Perform the Chi-Square test
-chi2 = chi2_contingency(contingency_table)
 
-print(f"p-value between age group and coffee consumption frequency: {chi2.pvalue}")
+def percentage(contingency_table):
+    return contingency_table.div(contingency_table.sum(axis=1), axis=0) * 100
+
+
+def report_test(contingency_table, subject, permutations=None, seed=0, jobs=1, design_effect=1):
+    # scipy.stats and seaborn are imported where they are used, so importing this module for its counts stays cheap
+    from scipy.stats import chi2_contingency, chi2 as chi2_distribution
+
+    # Perform the Chi-Square test
+    with stage("statTest.chi2"):
+        chi2 = chi2_contingency(contingency_table)
+    pvalue = chi2.pvalue
+
+    # Weighted tables: first-order Rao-Scott correction, the statistic divided by the design effect of the weights
+    if design_effect != 1:
+        pvalue = chi2_distribution.sf(chi2.statistic / design_effect, chi2.dof)
+
+    print(f"p-value between age group and {subject}: {pvalue}")
+
+    # The asymptotic p-value is unreliable for thin cells, a permutation test does not depend on it.
+    # Weighted tables are permuted at the effective sample size, rounded to whole respondents.
+    if permutations:
+        result = permutation_test(np.rint(contingency_table.to_numpy() / design_effect), permutations, seed, jobs)
+        pvalue = result["p_value"]
+        print(f"Permutation p-value ({permutations} permutations): {pvalue} "
+              f"(standard error {result['standard_error']:.2g})")
 
-alpha = 0.05
-if chi2.pvalue < alpha:
-    print("Conclusion: There is a significant relationship between age groups and coffee consumption frequency.\n")
-else:
-    print("Conclusion: No significant relationship between age groups and coffee consumption frequency.\n")
-    
-contingency_table_percentage.plot(kind='barh', stacked = True, figsize=(20, 12))
-plt.title("Stacked Bar Chart of Coffee Consumption Frequency by Age Group")
-plt.xlabel("Consumption (in %)")
-plt.ylabel("Age Group")
-plt.savefig('coffee_consumption_by_age.png', dpi=300)
-
-#plt.show()
-
-################################################################################################################################
-
-#This section prints and output bar chart for most popular and unpopular brewing method for each age group
-
-# Group by age and sum the selections for each brewing method
-brewing_columns = [
-    "How do you brew coffee at home? (Pour over)",
-    "How do you brew coffee at home? (French press)",
-    "How do you brew coffee at home? (Espresso)",
-    "How do you brew coffee at home? (Coffee brewing machine (e.g. Mr. Coffee))",
-    "How do you brew coffee at home? (Pod/capsule machine (e.g. Keurig/Nespresso))",
-    "How do you brew coffee at home? (Instant coffee)",
-    "How do you brew coffee at home? (Bean-to-cup machine)",
-    "How do you brew coffee at home? (Cold brew)",
-    "How do you brew coffee at home? (Coffee extract (e.g. Cometeer))",
-    "How do you brew coffee at home? (Other)"
-]
-
-# Group by age group and sum the brewing method selections
-age_group_brewing = data.groupby("What is your age?")[brewing_columns].sum()
-
-most_popular_brewing = age_group_brewing.idxmax(axis=1)
-brewing_counts = age_group_brewing.max(axis=1)
-
-least_popular_brewing = age_group_brewing.idxmin(axis=1)
-unbrewing_counts = age_group_brewing.min(axis=1)
-
-print("Most Popular Brewing Method for Each Age Group:")
-print(most_popular_brewing)
-
-print("Least popular Brewing Method for Each Age Group:")
-print(least_popular_brewing)
-
-order = ['<18 years old', '18-24 years old', '25-34 years old', '35-44 years old', '45-54 years old', '55-64 years old', '>65 years old']
-
-# Create a DataFrame to use for plotting
-popular_brewing_df = pd.DataFrame({
-    'Age Group': most_popular_brewing.index,
-    'Most Popular Brewing Method': most_popular_brewing.values,
-    'Count': brewing_counts.values
-})
-
-popular_brewing_df['Age Group'] = pd.Categorical(popular_brewing_df['Age Group'], categories=order, ordered=True)
-popular_brewing_df = popular_brewing_df.sort_values('Age Group')
-
-plt.figure(figsize=(10, 6))
-sns.barplot(x='Age Group', y='Count', hue='Most Popular Brewing Method', data=popular_brewing_df)
-
-plt.title("Most Popular Brewing Method by Age Group")
-plt.xlabel("Age Group")
-plt.ylabel("Frequency of Most Popular Brewing Method")
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('most_popular_brewing_by_age.png', dpi=300)
-
-#plt.show()
-
-# Create a DataFrame to use for plotting
-unpopular_brewing_df = pd.DataFrame({
-    'Age Group': least_popular_brewing.index,
-    'Least popular Brewing Method': least_popular_brewing.values,
-    'Count': unbrewing_counts.values
-})
-
-unpopular_brewing_df['Age Group'] = pd.Categorical(unpopular_brewing_df['Age Group'], categories=order, ordered=True)
-unpopular_brewing_df = unpopular_brewing_df.sort_values('Age Group')
-
-plt.figure(figsize=(10, 6))
-sns.barplot(x='Age Group', y='Count', hue='Least popular Brewing Method', data=unpopular_brewing_df)
-
-plt.title("Least popular Brewing Method by Age Group")
-plt.xlabel("Age Group")
-plt.ylabel("Frequency of Least Popular Brewing Method")
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('least_popular_brewing_by_age.png', dpi=300)
-#plt.show()
-
-################################################################################################################################
-
-# This section output p-value and heatmap between age group and brewing methods
+    if pvalue < alpha:
+        print(f"Conclusion: There is a significant relationship between age groups and {subject}.\n")
+    else:
+        print(f"Conclusion: No significant relationship between age groups and {subject}.\n")
 
-# Define shorter labels for graph label
-short_labels = {
-    "How do you brew coffee at home? (Pour over)": "Pour Over",
-    "How do you brew coffee at home? (French press)": "French Press",
-    "How do you brew coffee at home? (Espresso)": "Espresso",
-    "How do you brew coffee at home? (Coffee brewing machine (e.g. Mr. Coffee))": "Brewing Machine",
-    "How do you brew coffee at home? (Pod/capsule machine (e.g. Keurig/Nespresso))": "Pod Machine",
-    "How do you brew coffee at home? (Instant coffee)": "Instant Coffee",
-    "How do you brew coffee at home? (Bean-to-cup machine)": "Bean-to-Cup",
-    "How do you brew coffee at home? (Cold brew)": "Cold Brew",
-    "How do you brew coffee at home? (Coffee extract (e.g. Cometeer))": "Coffee Extract",
-    "How do you brew coffee at home? (Other)": "Other"
-}
 
-# Drop rows with missing values in relevant columns
-brewing_data = data.dropna(subset=["What is your age?"] + brewing_columns)
-brewing_data.rename(columns=short_labels, inplace=True)
+def report(tables, permutations=None, seed=0, jobs=1):
+    design_effects = tables.get("design_effects", {})
+    report_test(tables["preference"], "coffee preferences", permutations, seed, jobs,
+                design_effects.get("preference", 1))
+    report_test(tables["consumption"], "coffee consumption frequency", permutations, seed, jobs,
+                design_effects.get("consumption", 1))
+
+    age_group_brewing = tables["brewing_totals"]
+    print("Most Popular Brewing Method for Each Age Group:")
+    print(age_group_brewing.idxmax(axis=1))
 
-# Reshape brewing columns
-brewing_data_melted = brewing_data.melt(
-    id_vars=["What is your age?"],
-    value_vars=short_labels.values(),
-    var_name="Brewing Method",
-    value_name="Count"
-)
+    print("Least popular Brewing Method for Each Age Group:")
+    print(age_group_brewing.idxmin(axis=1))
 
-brewing_data_melted = brewing_data_melted[brewing_data_melted["Count"] > 0]
+    report_test(tables["brewing"], "brewing methods", permutations, seed, jobs, design_effects.get("brewing", 1))
 
-# Create a contingency table
-contingency_table = pd.crosstab(brewing_data_melted["What is your age?"], brewing_data_melted["Brewing Method"])
-contingency_table_percentage = contingency_table.div(contingency_table.sum(axis=1), axis=0) * 100
 
-# Perform the Chi-Square test
-chi2 = chi2_contingency(contingency_table)
+@profiled("statTest.plot")
+def plot_preference_heatmap(contingency_table, output='coffee_preference_by_age.png'):
+    import seaborn as sns
+
+    plt.figure(figsize=(10, 6))
+    sns.heatmap(percentage(contingency_table), annot=True, cmap="YlGnBu", cbar=True)
 
-print(f"p-value between age group and brewing method: {chi2.pvalue}")
+    plt.title("Heatmap of Coffee Preferences by Age Group")
+    plt.xlabel("Coffee Preferences (in %)")
+    plt.ylabel("Age Groups")
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    with stage("statTest.savefig"):
+        plt.savefig(output, dpi=300)
+    plt.close()
 
-alpha = 0.05
-if chi2.pvalue < alpha:
-    print("Conclusion: There is a significant relationship between age groups and brewing methods.\n")
-else:
-    print("Conclusion: No significant relationship between age groups and brewing methods.\n")
-
-plt.figure(figsize=(12, 8))
-sns.heatmap(contingency_table_percentage, annot=True, cmap="YlGnBu", cbar=True)
-
-plt.title("Heatmap of Brewing Methods by Age Group")
-plt.xlabel("Brewing Method (in %)")
-plt.ylabel("Age Group")
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('brewing_method_by_age.png', dpi=300)
-
-# plt.show()
+
+@profiled("statTest.plot")
+def plot_consumption(contingency_table, output='coffee_consumption_by_age.png'):
+    contingency_table_percentage = percentage(contingency_table).reindex(order)
+
+    contingency_table_percentage.plot(kind='barh', stacked = True, figsize=(20, 12))
+    plt.title("Stacked Bar Chart of Coffee Consumption Frequency by Age Group")
+    plt.xlabel("Consumption (in %)")
+    plt.ylabel("Age Group")
+    with stage("statTest.savefig"):
+        plt.savefig(output, dpi=300)
+    plt.close()
+
+
+@profiled("statTest.plot")
+def plot_brewing_popularity(age_group_brewing, most_popular, output):
+    # Create a DataFrame to use for plotting
+    if most_popular:
+        method_label = 'Most Popular Brewing Method'
+        brewing = age_group_brewing.idxmax(axis=1)
+        brewing_counts = age_group_brewing.max(axis=1)
+    else:
+        method_label = 'Least popular Brewing Method'
+        brewing = age_group_brewing.idxmin(axis=1)
+        brewing_counts = age_group_brewing.min(axis=1)
+
+    brewing_df = pd.DataFrame({
+        'Age Group': brewing.index,
+        method_label: brewing.values,
+        'Count': brewing_counts.values
+    })
+
+    brewing_df['Age Group'] = pd.Categorical(brewing_df['Age Group'], categories=order, ordered=True)
+    brewing_df = brewing_df.sort_values('Age Group')
+
+    import seaborn as sns
+
+    plt.figure(figsize=(10, 6))
+    sns.barplot(x='Age Group', y='Count', hue=method_label, data=brewing_df)
+
+    plt.title(f"{method_label} by Age Group")
+    plt.xlabel("Age Group")
+    if most_popular:
+        plt.ylabel("Frequency of Most Popular Brewing Method")
+    else:
+        plt.ylabel("Frequency of Least Popular Brewing Method")
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    with stage("statTest.savefig"):
+        plt.savefig(output, dpi=300)
+    plt.close()
+
+
+def plot_most_popular(age_group_brewing, output='most_popular_brewing_by_age.png'):
+    plot_brewing_popularity(age_group_brewing, True, output)
+
+
+def plot_least_popular(age_group_brewing, output='least_popular_brewing_by_age.png'):
+    plot_brewing_popularity(age_group_brewing, False, output)
+
+
+@profiled("statTest.plot")
+def plot_brewing_heatmap(contingency_table, output='brewing_method_by_age.png'):
+    import seaborn as sns
+
+    plt.figure(figsize=(12, 8))
+    sns.heatmap(percentage(contingency_table), annot=True, cmap="YlGnBu", cbar=True)
+
+    plt.title("Heatmap of Brewing Methods by Age Group")
+    plt.xlabel("Brewing Method (in %)")
+    plt.ylabel("Age Group")
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    with stage("statTest.savefig"):
+        plt.savefig(output, dpi=300)
+    plt.close()
+
+
+def plot_all(tables, output_dir="."):
+    plot_preference_heatmap(tables["preference"], os.path.join(output_dir, 'coffee_preference_by_age.png'))
+    plot_consumption(tables["consumption"], os.path.join(output_dir, 'coffee_consumption_by_age.png'))
+    plot_most_popular(tables["brewing_totals"], os.path.join(output_dir, 'most_popular_brewing_by_age.png'))
+    plot_least_popular(tables["brewing_totals"], os.path.join(output_dir, 'least_popular_brewing_by_age.png'))
+    plot_brewing_heatmap(tables["brewing"], os.path.join(output_dir, 'brewing_method_by_age.png'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chi-square tests between age group and coffee habits")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="stream the CSV in chunks of this many rows instead of loading it whole")
+    parser.add_argument("--permutations", type=int, default=None,
+                        help="also run a Monte Carlo permutation test with this many permutations")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the permutation test")
+    parser.add_argument("--jobs", type=int, default=1, help="permutation worker processes (0 for all cores)")
+    parser.add_argument("--unweighted", action="store_true",
+                        help="count every respondent equally (always the case with --chunksize)")
+    args = parser.parse_args()
+
+    file_path = args.file_path
+    try:
+        if args.chunksize:
+            tables = build_tables_chunked(file_path, args.chunksize)
+        else:
+            data = load_survey(file_path, list(dict.fromkeys(COLUMNS + WEIGHTING_COLUMNS)))
+            tables = build_tables(data, None if args.unweighted else survey_weights(data))
+    except FileNotFoundError:
+        print(f"Error: File not found at {file_path}")
+        sys.exit(1)
+
+    report(tables, args.permutations, args.seed, args.jobs or None)
+    plot_all(tables)
+
+if __name__ == "__main__":
+    main()
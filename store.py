@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+from urllib.parse import quote, unquote
+import numpy as np
+import pandas as pd
+from loader import (read_header, read_columns, order_answers, order_columns, drop_unused_answers, file_hash,
+                    write_snapshot, read_snapshot_meta, read_snapshot, AGE, AGE_ORDER, MANIFEST_FILE)
+from profiling import profiled
+
+# A store is a directory of survey waves, Hive-style partitioned by wave and age group:
+#   <store>/wave=2024/age=25-34%20years%20old/   (one snapshot per partition, see loader.write_snapshot)
+# The partition values are percent-encoded in the directory names and not stored as columns.
+# The manifest lists every wave with its source CSV, row count, columns and renamed questions.
+WAVE = "Wave"
+MISSING_PARTITION = "__missing__"
+
+
+def partition_name(key, value):
+    return f"{key}={MISSING_PARTITION if value is None else quote(str(value), safe='')}"
+
+
+def partition_value(name):
+    value = unquote(name.partition("=")[2])
+    return None if value == MISSING_PARTITION else value
+
+
+def age_position(age):
+    if age in AGE_ORDER:
+        return (0, AGE_ORDER.index(age), "")
+    return (1 if age is not None else 2, 0, age or "")
+
+
+def read_manifest(root):
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"waves": {}}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(root, manifest):
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_schema(path):
+    # A schema file maps question names of a wave to the current ones: {"<old question>": "<question>", ...}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def store_columns(root):
+    # Every column of every wave, in first-seen order, the wave and age group first
+    manifest = read_manifest(root)
+    columns = [WAVE, AGE] + [column for wave in manifest["waves"].values() for column in wave["columns"]]
+    return list(dict.fromkeys(columns))
+
+
+@profiled("store.ingest")
+def ingest(root, file_path, wave, schema=None, replace=False):
+    # Parse a wave's CSV once, rename its questions to the current names and write one snapshot per age group.
+    # The wave is written under a temporary name and the manifest last, so readers never see half a wave.
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(file_path)
+    manifest = read_manifest(root)
+    wave = str(wave)
+    if wave in manifest["waves"] and not replace:
+        raise FileExistsError(f"Wave {wave} is already in {root}")
+
+    header = read_header(file_path)
+    renamed = {old: new for old, new in (schema or {}).items() if old in header}
+    data = order_columns(read_columns(file_path, header, header).rename(columns=renamed))
+    if AGE not in data.columns:
+        raise KeyError(f"{file_path} has no {AGE} column, map it in the schema file")
+
+    wave_dir = os.path.join(root, partition_name("wave", wave))
+    tmp_dir = wave_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    ages = data[AGE].astype("category")
+    codes = ages.cat.codes.to_numpy()
+    partitions = {}
+    for code, age in list(enumerate(ages.cat.categories)) + [(-1, None)]:
+        rows = codes == code
+        if rows.any():
+            partition = data.loc[rows].drop(columns=AGE).reset_index(drop=True)
+            write_snapshot(os.path.join(tmp_dir, partition_name("age", age)), partition)
+            partitions[MISSING_PARTITION if age is None else age] = int(rows.sum())
+
+    shutil.rmtree(wave_dir, ignore_errors=True)
+    os.replace(tmp_dir, wave_dir)
+    manifest["waves"][wave] = {"source": file_hash(file_path), "rows": len(data), "columns": list(data.columns),
+                               "renamed": renamed, "partitions": partitions}
+    write_manifest(root, manifest)
+    return manifest["waves"][wave]
+
+
+def selected_partitions(root, manifest, filters):
+    # (wave, age group, directory) of every partition the wave and age filters keep, without opening any of them.
+    # Age groups are read in survey order, missing age last.
+    waves = filters.get(WAVE)
+    ages = filters.get(AGE)
+    selected = []
+    for wave in sorted(manifest["waves"]):
+        if waves is not None and wave not in waves:
+            continue
+        wave_dir = os.path.join(root, partition_name("wave", wave))
+        partitions = [(partition_value(entry.name), entry.path) for entry in os.scandir(wave_dir)]
+        for age, path in sorted(partitions, key=lambda partition: age_position(partition[0])):
+            if ages is None or age in ages:
+                selected.append((wave, age, path))
+    return selected
+
+
+def combine_column(parts, sizes, entry):
+    # One column over every partition read. Partitions of a wave without the question hold None and read as
+    # missing; category codes are remapped onto the union of the partitions' categories.
+    if entry["kind"] == "category":
+        dtypes = [part.dtype for part in parts if part is not None]
+        if entry["ordered"]:
+            # Known answers first in every wave, answers only some waves gave after them
+            categories = list(dict.fromkeys(category for dtype in dtypes for category in dtype.categories))
+            dtype = pd.CategoricalDtype(categories, ordered=True)
+        else:
+            categories = sorted(set().union(*[dtype.categories for dtype in dtypes]), key=str)
+            dtype = pd.CategoricalDtype(categories)
+        codes = []
+        for part, size in zip(parts, sizes):
+            if part is None:
+                codes.append(np.full(size, -1))
+            else:
+                mapping = np.append(dtype.categories.get_indexer(part.categories), -1)
+                codes.append(mapping[part.codes])
+        return pd.Categorical.from_codes(np.concatenate(codes or [np.zeros(0, dtype=np.int64)]), dtype=dtype)
+    if entry["kind"] == "boolean":
+        values = [np.zeros(size, dtype=bool) if part is None else part.to_numpy(dtype=bool, na_value=False)
+                  for part, size in zip(parts, sizes)]
+        missing = [np.ones(size, dtype=bool) if part is None else part.isna() for part, size in zip(parts, sizes)]
+        return pd.arrays.BooleanArray(np.concatenate(values or [np.zeros(0, dtype=bool)]),
+                                      np.concatenate(missing or [np.zeros(0, dtype=bool)]))
+    values = [np.full(size, np.nan) if part is None else np.asarray(part, dtype=np.float64)
+              for part, size in zip(parts, sizes)]
+    return np.concatenate(values or [np.zeros(0)])
+
+
+@profiled("store.read")
+def read_store(root, columns=None, filters=None):
+    # Read the requested columns of the partitions the filters keep. Wave and age group filters are pushed
+    # down to the partition directories; filters on other columns are applied to the rows read.
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(manifest_path)
+    manifest = read_manifest(root)
+    filters = {column: [None if value is None else str(value) for value in values]
+               for column, values in (filters or {}).items()}
+    known = store_columns(root)
+    columns = known if columns is None else list(columns)
+    for column in columns + list(filters):
+        if column not in known:
+            raise KeyError(f"{column} is not a column of any wave in {root}")
+    read = list(dict.fromkeys([column for column in columns + list(filters) if column not in (WAVE, AGE)]))
+
+    partitions = selected_partitions(root, manifest, filters)
+    if not partitions:
+        pushed = [f"{key}={','.join(str(value) for value in filters[column])}"
+                  for key, column in (("wave", WAVE), ("age", AGE)) if column in filters]
+        raise KeyError(f"No partition of {root} matches {' '.join(pushed) or 'the filters'}")
+    sizes, frames, entries = [], [], {}
+    for wave, age, path in partitions:
+        meta = read_snapshot_meta(path)
+        present = [column for column in read if column in meta["columns"]]
+        frames.append(read_snapshot(path, present, meta))
+        sizes.append(meta["rows"])
+        for column in present:
+            entries.setdefault(column, meta["columns"][column])
+
+    frame = {}
+    for column in columns + [column for column in filters if column not in columns]:
+        if column == WAVE:
+            frame[column] = pd.Categorical(np.repeat([wave for wave, _, _ in partitions], sizes),
+                                           categories=sorted(manifest["waves"]))
+        elif column == AGE:
+            frame[column] = order_answers(np.repeat([age for _, age, _ in partitions], sizes), AGE)
+        elif column in entries:
+            parts = [part[column].array if column in part.columns else None for part in frames]
+            frame[column] = combine_column(parts, sizes, entries[column])
+        else:
+            raise KeyError(f"{column} is not a column of the selected waves of {root}")
+    data = pd.DataFrame(frame)
+
+    for column, values in filters.items():
+        if column not in (WAVE, AGE):
+            data = data[data[column].astype(str).isin(values).to_numpy()]
+    return drop_unused_answers(data[columns].reset_index(drop=True), filters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitioned store of survey waves")
+    parser.add_argument("store", help="store directory")
+    parser.add_argument("command", choices=["ingest", "info"])
+    parser.add_argument("file_path", nargs="?", help="wave CSV to ingest")
+    parser.add_argument("--wave", help="name of the ingested wave, e.g. its year")
+    parser.add_argument("--schema", default=None, help="JSON file mapping this wave's question names to current ones")
+    parser.add_argument("--replace", action="store_true", help="replace a wave already in the store")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        if not args.file_path or not args.wave:
+            parser.error("ingest needs a CSV and --wave")
+        os.makedirs(args.store, exist_ok=True)
+        try:
+            schema = load_schema(args.schema) if args.schema else None
+            wave = ingest(args.store, args.file_path, args.wave, schema, args.replace)
+        except FileNotFoundError as error:
+            print(f"Error: File not found at {error.args[0]}")
+            sys.exit(1)
+        except (FileExistsError, KeyError) as error:
+            print(f"Error: {error.args[0]}")
+            sys.exit(1)
+        print(f"Ingested wave {args.wave}: {wave['rows']} respondents in {len(wave['partitions'])} partitions, "
+              f"{len(wave['renamed'])} questions renamed")
+    else:
+        manifest = read_manifest(args.store)
+        rows = [{WAVE: wave, AGE: age, "Respondents": count}
+                for wave, entry in sorted(manifest["waves"].items()) for age, count in entry["partitions"].items()]
+        print(pd.DataFrame(rows, columns=[WAVE, AGE, "Respondents"]).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
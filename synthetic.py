@@ -0,0 +1,110 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from loader import read_header, is_checkbox, AGE, SUBMISSION_ID
+
+# Rows generated and written per chunk, so any number of rows fits in memory
+CHUNKSIZE = 100000
+
+# Share of a synthetic respondent's questions answered by another respondent of the same age group, so rows
+# are not exact copies of real ones while the relations between questions stay almost intact
+SWAP_FRACTION = 0.05
+
+# Part of the names of generated files kept for reuse (see benchmark.py), bump it when the generator changes
+GENERATOR_VERSION = 2
+
+
+def column_groups(header):
+    # Multi-select questions are sampled together with their checkbox columns, so the answer text
+    # and the checkboxes of a synthetic respondent always agree. Every other column is its own group.
+    groups = []
+    grouped = set()
+    for column in header:
+        if column in grouped or column in (SUBMISSION_ID, AGE):
+            continue
+        members = [column] + [other for other in header
+                              if other != column and other.startswith(column + " (") and is_checkbox(other, header)]
+        grouped.update(members)
+        groups.append(members)
+    return groups
+
+
+def fit(file_path):
+    # The source survey itself is the model: whole respondents are resampled within their age group, which
+    # keeps every column's marginal distribution, its relationship with age and the relations between questions
+    header = read_header(file_path)
+    source = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+    source.columns = header
+
+    age_labels, age_codes = np.unique(source[AGE].to_numpy(), return_inverse=True)
+    order = np.argsort(age_codes, kind="stable")
+    sizes = np.bincount(age_codes, minlength=len(age_labels))
+    return {
+        "header": header,
+        "source": source,
+        "groups": column_groups(header),
+        "age_labels": age_labels,
+        "age_probabilities": sizes / sizes.sum(),
+        "rows_by_age": order,
+        "age_offsets": np.concatenate([[0], np.cumsum(sizes)[:-1]]),
+        "age_sizes": sizes,
+    }
+
+
+def submission_ids(start, count):
+    # Unique IDs that cannot collide with the real six-character ones
+    return np.char.add("SYN", np.arange(start, start + count).astype(str))
+
+
+def same_age_rows(model, age_codes, rng):
+    # A random real respondent of the same age group for every synthetic row
+    within = (rng.random(len(age_codes)) * model["age_sizes"][age_codes]).astype(np.int64)
+    return model["rows_by_age"][model["age_offsets"][age_codes] + within]
+
+
+def generate_chunk(model, start, count, rng, swap_fraction=SWAP_FRACTION):
+    source = model["source"]
+    age_codes = rng.choice(len(model["age_labels"]), size=count, p=model["age_probabilities"])
+    chunk = {SUBMISSION_ID: submission_ids(start, count), AGE: model["age_labels"][age_codes]}
+
+    # Every synthetic row copies one real respondent; each question group is swapped for another same-age
+    # respondent's answers with probability swap_fraction
+    rows = same_age_rows(model, age_codes, rng)
+    for group in model["groups"]:
+        swapped = rng.random(count) < swap_fraction
+        group_rows = rows.copy()
+        group_rows[swapped] = same_age_rows(model, age_codes[swapped], rng)
+        for column in group:
+            chunk[column] = source[column].to_numpy()[group_rows]
+    return pd.DataFrame(chunk, columns=model["header"])
+
+
+def generate(file_path, output, rows, seed=0, chunksize=CHUNKSIZE):
+    model = fit(file_path)
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunksize):
+        chunk = generate_chunk(model, start, min(chunksize, rows - start), rng)
+        chunk.to_csv(output, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    if rows == 0:
+        pd.DataFrame(columns=model["header"]).to_csv(output, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic survey with the GACTT schema and distributions")
+    parser.add_argument("file_path", help="the real survey CSV the distributions are taken from")
+    parser.add_argument("output", help="CSV to write")
+    parser.add_argument("--rows", type=int, default=100000, help="number of synthetic respondents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="rows generated per chunk")
+    args = parser.parse_args()
+
+    try:
+        generate(args.file_path, args.output, args.rows, args.seed, args.chunksize)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+    print(f"Wrote {args.rows} synthetic responses to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import logsumexp
+from loader import load_survey, AGE, EXPERTISE
+from profiling import profiled
+from weighting import survey_weights, COLUMNS as WEIGHTING_COLUMNS
+
+COFFEES = ["Coffee A", "Coffee B", "Coffee C", "Coffee D"]
+
+RATINGS = {attribute: [f"{coffee} - {attribute}" for coffee in COFFEES]
+           for attribute in ("Bitterness", "Acidity", "Personal Preference")}
+
+# Choice questions: question -> the coffees it offered
+CHOICES = {
+    "Between Coffee A, Coffee B, and Coffee C which did you prefer?": ["Coffee A", "Coffee B", "Coffee C"],
+    "Between Coffee A and Coffee D, which did you prefer?": ["Coffee A", "Coffee D"],
+    "Lastly, what was your favorite overall coffee?": COFFEES,
+}
+
+SEGMENTS = [AGE, "Gender", EXPERTISE]
+
+COLUMNS = SEGMENTS + list(CHOICES) + [column for columns in RATINGS.values() for column in columns]
+
+# Every choice is stored as (set of coffees offered as a bitmask, coffee chosen)
+N_SETS = 2 ** len(COFFEES)
+MEMBERS = ((np.arange(N_SETS)[:, None] >> np.arange(len(COFFEES))) & 1).astype(bool)
+
+# Gaussian prior precision on the log-worths: keeps a segment finite when a coffee never wins there
+PRIOR = 0.1
+
+# Segments fitted per pool task
+BATCH_SIZE = 32
+
+
+def segment_codes(data):
+    # Age group x gender x expertise code of every respondent (-1 if any of them is missing) and the labels
+    keys = np.column_stack([pd.Categorical(data[column]).codes for column in SEGMENTS])
+    complete = (keys >= 0).all(axis=1)
+    combinations, inverse = np.unique(keys[complete], axis=0, return_inverse=True)
+    codes = np.full(len(data), -1, dtype=np.int64)
+    codes[complete] = inverse.ravel()
+    categories = [pd.Categorical(data[column]).categories for column in SEGMENTS]
+    labels = pd.DataFrame({column: categories[i][combinations[:, i]] for i, column in enumerate(SEGMENTS)})
+    return codes, labels
+
+
+def choice_counts(data, codes, n_segments, weights=None):
+    # (segments + 1) x sets x winners choice counts; the last segment holds respondents with a missing segment.
+    # Each choice question is one choice. Each pair of different Personal Preference ratings is a choice of the
+    # higher rated coffee from the two, but one respondent's pairs come from the same four ratings, so together
+    # they count as one choice (1 / pairs each). With survey weights a choice counts its respondent's weight.
+    flat = np.zeros((n_segments + 1) * N_SETS * len(COFFEES))
+    segments = np.where(codes >= 0, codes, n_segments)
+    weights = np.ones(len(data)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    def add(valid, sets, winners, shares=1):
+        index = (segments[valid] * N_SETS + sets[valid]) * len(COFFEES) + winners[valid]
+        flat[:] += np.bincount(index, weights=(weights * shares)[valid], minlength=len(flat))
+
+    for question, offered in CHOICES.items():
+        winners = pd.Categorical(data[question], categories=COFFEES).codes.astype(np.int64)
+        mask = sum(1 << COFFEES.index(coffee) for coffee in offered)
+        add(winners >= 0, np.full(len(data), mask), winners)
+
+    ratings = data[RATINGS["Personal Preference"]].to_numpy(dtype=np.float64)
+    first, second = np.triu_indices(len(COFFEES), k=1)
+    ordered = ratings[:, first] != ratings[:, second]
+    ordered &= ~np.isnan(ratings[:, first]) & ~np.isnan(ratings[:, second])
+    with np.errstate(divide="ignore"):
+        shares = 1 / ordered.sum(axis=1)
+    for i, j in zip(first, second):
+        sets = np.full(len(data), (1 << i) | (1 << j))
+        add(ratings[:, i] > ratings[:, j], sets, np.full(len(data), i), shares)
+        add(ratings[:, j] > ratings[:, i], sets, np.full(len(data), j), shares)
+
+    return flat.reshape(n_segments + 1, N_SETS, len(COFFEES))
+
+
+def choice_probabilities(theta):
+    # Probability of each coffee being chosen from every offered set (rows), Luce's choice axiom
+    logits = np.where(MEMBERS[1:], theta, -np.inf)
+    return np.exp(logits - logsumexp(logits, axis=1, keepdims=True))
+
+
+def negative_log_likelihood(free, counts, prior=PRIOR):
+    # Plackett-Luce / Bradley-Terry likelihood from the choice counts, with Coffee A's log-worth fixed at 0
+    theta = np.concatenate([[0.0], free])
+    logits = np.where(MEMBERS[1:], theta, -np.inf)
+    offered = counts[1:].sum(axis=1)
+    wins = counts.sum(axis=0)
+    value = offered @ logsumexp(logits, axis=1) - wins @ theta + prior / 2 * free @ free
+    gradient = offered @ choice_probabilities(theta) - wins
+    return value, gradient[1:] + prior * free
+
+
+def hessian(free, counts, prior=PRIOR):
+    theta = np.concatenate([[0.0], free])
+    probabilities = choice_probabilities(theta)
+    offered = counts[1:].sum(axis=1)
+    information = np.diag(offered @ probabilities) - np.einsum("m,mi,mj->ij", offered, probabilities, probabilities)
+    return information[1:, 1:] + prior * np.eye(len(free))
+
+
+def fit(counts, start=None, prior=PRIOR):
+    # Maximum a posteriori log-worths and their covariance from the inverse Hessian
+    start = np.zeros(len(COFFEES) - 1) if start is None else start
+    result = minimize(negative_log_likelihood, start, args=(counts, prior), jac=True, method="L-BFGS-B")
+    covariance = np.linalg.inv(hessian(result.x, counts, prior))
+    return np.concatenate([[0.0], result.x]), covariance
+
+
+def fit_batch(batch, start, prior):
+    return [fit(counts, start, prior) for counts in batch]
+
+
+@profiled("tasting.segments")
+def fit_segments(counts, start, prior=PRIOR, jobs=1, batch_size=BATCH_SIZE):
+    # Every segment starts from the overall fit, batches of segments are fitted in parallel
+    batches = [counts[i:i + batch_size] for i in range(0, len(counts), batch_size)]
+    if jobs == 1:
+        results = [fit_batch(batch, start, prior) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(fit_batch, batches, [start] * len(batches), [prior] * len(batches)))
+    return [result for batch in results for result in batch]
+
+
+def ranking(theta, covariance, confidence_z=1.96):
+    # Log-worth relative to Coffee A with its interval, the share of "favorite of all four" choices and the rank
+    standard_errors = np.sqrt(np.concatenate([[0.0], np.diag(covariance)]))
+    shares = np.exp(theta - logsumexp(theta))
+    return pd.DataFrame({
+        "Coffee": COFFEES,
+        "Log-worth": theta,
+        "Lower": theta - confidence_z * standard_errors,
+        "Upper": theta + confidence_z * standard_errors,
+        "Share": shares,
+        "Rank": (-theta).argsort().argsort() + 1,
+    })
+
+
+def attribute_means(data, codes, n_segments, weights=None):
+    # Mean Bitterness and Acidity rating of each coffee per segment
+    weights = np.ones(len(data)) if weights is None else weights
+    means = {}
+    for attribute in ("Bitterness", "Acidity"):
+        for coffee, column in zip(COFFEES, RATINGS[attribute]):
+            values = data[column].to_numpy(dtype=np.float64)
+            valid = (codes >= 0) & ~np.isnan(values)
+            totals = np.bincount(codes[valid], weights=values[valid] * weights[valid], minlength=n_segments)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[attribute, coffee] = totals / np.bincount(codes[valid], weights=weights[valid],
+                                                                minlength=n_segments)
+    return means
+
+
+def rankings(data, prior=PRIOR, jobs=1, weights=None):
+    codes, labels = segment_codes(data)
+    counts = choice_counts(data, codes, len(labels), weights)
+    if weights is None:
+        overall = fit(counts.sum(axis=0), prior=prior)
+    else:
+        # Weighted counts are scaled by 1 / design effect (sum(w) / sum(w^2)) of the respondents they come from,
+        # so the intervals reflect the effective sample size instead of the respondent count
+        weights = np.asarray(weights, dtype=np.float64)
+        overall = fit(counts.sum(axis=0) * weights.sum() / (weights ** 2).sum(), prior=prior)
+        complete = codes >= 0
+        totals = np.bincount(codes[complete], weights=weights[complete], minlength=len(labels))
+        squares = np.bincount(codes[complete], weights=weights[complete] ** 2, minlength=len(labels))
+        counts[:-1] *= (totals / squares)[:, None, None]
+    fits = fit_segments(counts[:-1], overall[0][1:], prior, jobs)
+    respondents = np.bincount(codes[codes >= 0], minlength=len(labels))
+    means = attribute_means(data, codes, len(labels), weights)
+
+    tables = []
+    for segment, (theta, covariance) in enumerate(fits):
+        table = ranking(theta, covariance)
+        for i, column in enumerate(SEGMENTS):
+            table.insert(i, column, labels[column][segment])
+        table.insert(len(SEGMENTS), "Respondents", respondents[segment])
+        table["Bitterness"] = [means["Bitterness", coffee][segment] for coffee in COFFEES]
+        table["Acidity"] = [means["Acidity", coffee][segment] for coffee in COFFEES]
+        tables.append(table)
+    return ranking(*overall), pd.concat(tables, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preference model of the Coffee A-D blind tasting per segment")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--output", default="tasting_rankings.csv", help="per-segment rankings")
+    parser.add_argument("--prior", type=float, default=PRIOR, help="prior precision on the log-worths")
+    parser.add_argument("--min-respondents", type=int, default=30, help="smallest segment printed")
+    parser.add_argument("--jobs", type=int, default=1, help="fitting worker processes (0 for all cores)")
+    parser.add_argument("--unweighted", action="store_true", help="count every respondent equally")
+    args = parser.parse_args()
+
+    try:
+        data = load_survey(args.file_path, list(dict.fromkeys(COLUMNS + WEIGHTING_COLUMNS)))
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    weights = None if args.unweighted else survey_weights(data)
+    overall, segments = rankings(data, args.prior, args.jobs or None, weights)
+    segments.to_csv(args.output, index=False)
+
+    print("Overall ranking:")
+    print(overall.sort_values("Rank").to_string(index=False))
+    favourites = segments[(segments["Rank"] == 1) & (segments["Respondents"] >= args.min_respondents)]
+    print(f"\nFavorite coffee of each segment with at least {args.min_respondents} respondents:")
+    print(favourites.drop(columns=["Rank"]).to_string(index=False))
+    print(f"\nRankings of all {len(segments) // len(COFFEES)} segments saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
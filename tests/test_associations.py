@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency
+from associations import associations
+
+
+def test_pairs_match_chi2_contingency():
+    rng = np.random.default_rng(0)
+    n = 600
+    group = rng.integers(0, 3, n)
+    data = pd.DataFrame({
+        "Group": pd.Categorical(np.array(["x", "y", "z"])[group]),
+        "Habit": pd.Categorical(np.where(rng.random(n) < 0.4, "p", np.where(group == 0, "q", "r"))),
+        "Rating": rng.integers(1, 5, n).astype(np.float64),
+        "Checked": pd.array(rng.random(n) < 0.5, dtype="boolean"),
+    })
+    # Each pair only uses the respondents who answered both questions
+    data.loc[rng.random(n) < 0.1, "Group"] = np.nan
+    data.loc[rng.random(n) < 0.1, "Rating"] = np.nan
+    data.loc[rng.random(n) < 0.1, "Checked"] = pd.NA
+
+    _, table, _ = associations(data)
+    assert len(table) == 6
+    for row in table.to_dict("records"):
+        both = data[[row["Question A"], row["Question B"]]].dropna()
+        observed = pd.crosstab(both[row["Question A"]], both[row["Question B"]])
+        expected = chi2_contingency(observed, correction=False)
+        assert row["Respondents"] == len(both)
+        assert row["DOF"] == expected.dof
+        assert np.isclose(row["Chi2"], expected.statistic)
+        assert np.isclose(row["p-value"], expected.pvalue)
+        assert np.isclose(row["Cramer's V"], np.sqrt(expected.statistic / (len(both) * (min(observed.shape) - 1))))
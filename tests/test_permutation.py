@@ -0,0 +1,25 @@
+import numpy as np
+from permutation import permutation_test, expected_counts, chi2_statistics
+
+
+def test_matches_label_shuffle_simulation():
+    # Sparse table where the chi-square approximation is poor: the p-value of shuffling the column labels of
+    # the respondents themselves must agree with the hypergeometric tables within Monte Carlo error
+    rng = np.random.default_rng(1)
+    rows = np.repeat([0, 1, 2], [20, 12, 8])
+    columns = np.where(rng.random(len(rows)) < 0.3, rows, rng.integers(0, 4, len(rows)))
+    observed = np.zeros((3, 4), dtype=np.int64)
+    np.add.at(observed, (rows, columns), 1)
+
+    permutations = 20000
+    shuffled = rng.permuted(np.tile(columns, (permutations, 1)), axis=1)
+    cells = np.arange(permutations)[:, None] * observed.size + rows * observed.shape[1] + shuffled
+    tables = np.bincount(cells.ravel(), minlength=permutations * observed.size).reshape(permutations, 3, 4)
+    expected = expected_counts(observed)
+    statistic = chi2_statistics(observed, expected)
+    simulated = ((chi2_statistics(tables, expected) >= statistic * (1 - 1e-9)).sum() + 1) / (permutations + 1)
+
+    result = permutation_test(observed, permutations, seed=0)
+    assert np.isclose(result["statistic"], statistic)
+    tolerance = 4 * np.sqrt(2 * simulated * (1 - simulated) / permutations)
+    assert abs(result["p_value"] - simulated) < tolerance
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from tasting import rankings, RATINGS, COLUMNS, SEGMENTS
+
+
+def rated(ratings):
+    # Respondents of one segment who only rated the coffees, one row of Personal Preference ratings each
+    data = pd.DataFrame({column: pd.Series([None] * len(ratings), dtype=object) for column in COLUMNS})
+    for column in SEGMENTS:
+        data[column] = "x"
+    data[RATINGS["Personal Preference"]] = np.asarray(ratings, dtype=np.float64)
+    return data
+
+
+def interval_width(data, coffee="Coffee B"):
+    overall, _ = rankings(data)
+    row = overall.set_index("Coffee").loc[coffee]
+    return row["Upper"] - row["Lower"]
+
+
+def test_duplicated_rating_pairs_do_not_narrow_the_interval():
+    # The same A vs B preference, once as a single rating pair and once repeated by rating C like A and D like B
+    rng = np.random.default_rng(4)
+    prefers_a = rng.random(400) < 0.6
+    high, low = np.where(prefers_a, 2, 1), np.where(prefers_a, 1, 2)
+    single = rated(np.column_stack([high, low, np.full(400, np.nan), np.full(400, np.nan)]))
+    repeated = rated(np.column_stack([high, low, high, low]))
+    assert interval_width(repeated) >= interval_width(single)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from loader import AGE
+from weighting import rake, survey_weights, DEFAULT_TARGETS
+
+
+def test_rake_recovers_margins():
+    # A population with known margins, sampled with a response rate that depends on every dimension:
+    # raking the sample to the population margins must give back those margins and the joint distribution
+    rng = np.random.default_rng(2)
+    margins = [np.array([0.2, 0.3, 0.5]), np.array([0.6, 0.4]), np.array([0.1, 0.2, 0.3, 0.4])]
+    response = [np.array([0.9, 0.3, 0.1]), np.array([0.2, 0.8]), np.array([1.0, 0.5, 0.25, 0.125])]
+    population = [rng.choice(len(shares), 500000, p=shares) for shares in margins]
+    rate = np.prod([rates[codes] for rates, codes in zip(response, population)], axis=0)
+    sampled = rng.random(len(rate)) < rate
+    codes = [dimension[sampled] for dimension in population]
+
+    weights = rake(codes, margins)
+    for dimension, shares in zip(codes, margins):
+        assert np.allclose(np.bincount(dimension, weights=weights) / weights.sum(), shares, atol=1e-8)
+
+    shape = [len(shares) for shares in margins]
+    cells = np.ravel_multi_index(codes, shape)
+    joint = np.bincount(cells, weights=weights, minlength=np.prod(shape)) / weights.sum()
+    expected = np.einsum("i,j,k->ijk", *margins).ravel()
+    assert np.abs(joint - expected).max() < 0.01
+
+
+def test_survey_weights_stay_within_cap():
+    # Old and less educated respondents are rare, so reaching the targets would need weights far above the cap
+    rng = np.random.default_rng(3)
+    n = 5000
+    columns = {}
+    for column, targets in DEFAULT_TARGETS.items():
+        levels = list(targets)
+        observed = np.exp(-0.8 * np.arange(len(levels)))
+        columns[column] = rng.choice(levels, n, p=observed / observed.sum())
+    data = pd.DataFrame(columns)
+    data.loc[rng.random(n) < 0.05, AGE] = None
+
+    for cap in (2, 5, 10):
+        weights = survey_weights(data, cap=cap)
+        assert np.isclose(weights.mean(), 1)
+        assert weights.max() <= cap * weights.mean()
+        assert weights.min() >= weights.mean() / cap
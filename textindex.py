@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import sys
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from loader import load_survey, read_header, snapshot_path, SUBMISSION_ID, FREE_TEXT_COLUMNS
+from profiling import profiled
+
+# Lowercase words, keeping apostrophes inside them ("don't")
+TOKEN_PATTERN = r"[a-z]+(?:'[a-z]+)?"
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have i if in is it its it's just like more my no not of on or
+so than that the this to too very was were with would you your
+""".split())
+
+# The index is kept next to the survey snapshot, so it is rebuilt whenever the CSV changes
+INDEX_DIR = "text"
+
+
+def tokenize(texts):
+    # Token lists of each text, without stopwords and single letters
+    tokens = pd.Series(texts, dtype=object).str.lower().str.findall(TOKEN_PATTERN)
+    return [[token for token in words if len(token) > 1 and token not in STOPWORDS] for words in tokens]
+
+
+@profiled("textindex.build")
+def build_index(data, columns=FREE_TEXT_COLUMNS):
+    # Each non-empty answer to a free-text column is one document. Answers repeat a lot ("Fruity"), so only
+    # the distinct answers of each column are tokenized, and every document takes the term row of its answer.
+    answers, offsets, documents = [], [], []
+    for column_code, column in enumerate(columns):
+        values = data[column].astype("category")
+        codes = values.cat.codes.to_numpy(dtype=np.int64)
+        rows = np.flatnonzero(codes >= 0)
+        offsets.append(len(answers))
+        answers.extend(values.cat.categories.astype(str))
+        documents.append((rows, np.full(len(rows), column_code), offsets[-1] + codes[rows]))
+
+    tokens = tokenize(answers)
+    terms, term_codes = np.unique(np.array([token for words in tokens for token in words], dtype=str),
+                                  return_inverse=True)
+    answer_index = np.repeat(np.arange(len(answers)), [len(words) for words in tokens])
+    answer_terms = sp.csr_matrix((np.ones(len(answer_index), dtype=np.int32), (answer_index, term_codes.ravel())),
+                                 shape=(len(answers), len(terms)))
+    answer_terms.sum_duplicates()
+
+    rows, column_codes, answer_codes = (np.concatenate(parts) for parts in zip(*documents))
+    doc_terms = answer_terms[answer_codes]
+    return {
+        "terms": terms.tolist(),
+        "columns": list(columns),
+        "rows": rows.astype(np.int64),
+        "column_codes": column_codes.astype(np.int16),
+        "doc_terms": doc_terms.tocsr(),
+        # Term -> documents, the inverted index
+        "term_docs": doc_terms.tocsc(),
+    }
+
+
+def save_index(index_dir, index):
+    os.makedirs(index_dir, exist_ok=True)
+    sp.save_npz(os.path.join(index_dir, "doc_terms.npz"), index["doc_terms"])
+    sp.save_npz(os.path.join(index_dir, "term_docs.npz"), index["term_docs"])
+    np.savez(os.path.join(index_dir, "documents.npz"), rows=index["rows"], column_codes=index["column_codes"])
+    # Written last so an interrupted build is never mistaken for a complete index
+    tmp_path = os.path.join(index_dir, "vocabulary.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"terms": index["terms"], "columns": index["columns"]}, f)
+    os.replace(tmp_path, os.path.join(index_dir, "vocabulary.json"))
+
+
+def read_index(index_dir):
+    vocabulary_path = os.path.join(index_dir, "vocabulary.json")
+    if not os.path.exists(vocabulary_path):
+        return None
+    with open(vocabulary_path, encoding="utf-8") as f:
+        vocabulary = json.load(f)
+    documents = np.load(os.path.join(index_dir, "documents.npz"))
+    return {
+        "terms": vocabulary["terms"],
+        "columns": vocabulary["columns"],
+        "rows": documents["rows"],
+        "column_codes": documents["column_codes"],
+        "doc_terms": sp.load_npz(os.path.join(index_dir, "doc_terms.npz")).tocsr(),
+        "term_docs": sp.load_npz(os.path.join(index_dir, "term_docs.npz")).tocsc(),
+    }
+
+
+@lru_cache(maxsize=4)
+def open_index(file_path, rebuild=False):
+    # The persisted index of a survey CSV, built on first use
+    index_dir = os.path.join(snapshot_path(file_path), INDEX_DIR)
+    index = None if rebuild else read_index(index_dir)
+    if index is None:
+        index = build_index(load_survey(file_path, FREE_TEXT_COLUMNS))
+        save_index(index_dir, index)
+    index["term_codes"] = {term: code for code, term in enumerate(index["terms"])}
+    return index
+
+
+@lru_cache(maxsize=64)
+def respondent_mask(file_path, filters=()):
+    # Respondents matching every (column, answer) filter
+    if not filters:
+        return None
+    unknown = {column for column, _ in filters} - set(read_header(file_path))
+    if unknown:
+        raise KeyError(f"Cannot filter on {', '.join(sorted(unknown))}, not a column of {file_path}")
+    data = load_survey(file_path, [column for column, _ in filters])
+    mask = np.ones(len(data), dtype=bool)
+    for column, value in filters:
+        mask &= (data[column].astype(str) == value).to_numpy()
+    return mask
+
+
+def select_documents(index, file_path, column=None, filters=()):
+    # Documents of one column (all free-text columns if None) written by respondents matching the filters
+    selected = np.ones(len(index["rows"]), dtype=bool)
+    if column is not None:
+        if column not in index["columns"]:
+            raise KeyError(f"{column} is not an indexed free-text column")
+        selected &= index["column_codes"] == index["columns"].index(column)
+    mask = respondent_mask(file_path, filters)
+    if mask is not None:
+        selected &= mask[index["rows"]]
+    return selected
+
+
+@lru_cache(maxsize=256)
+def top_terms(file_path, column=None, filters=(), top=20):
+    # Most frequent terms as (term, notes mentioning it) pairs, counted from the term rows of the selected notes
+    index = open_index(file_path)
+    documents = index["doc_terms"][np.flatnonzero(select_documents(index, file_path, column, filters))]
+    notes = np.bincount(documents.indices, minlength=len(index["terms"]))
+    ranked = np.argsort(-notes, kind="stable")[:top]
+    return tuple((index["terms"][code], int(notes[code])) for code in ranked if notes[code] > 0)
+
+
+@lru_cache(maxsize=256)
+def search(file_path, term, column=None, filters=()):
+    # (respondent row, column) of every note mentioning the term, read from the term's inverted list
+    index = open_index(file_path)
+    code = index["term_codes"].get(term.lower())
+    if code is None:
+        return ()
+    term_docs = index["term_docs"]
+    documents = term_docs.indices[term_docs.indptr[code]:term_docs.indptr[code + 1]]
+    documents = documents[select_documents(index, file_path, column, filters)[documents]]
+    return tuple((int(index["rows"][document]), index["columns"][index["column_codes"][document]])
+                 for document in np.sort(documents))
+
+
+def parse_filter(value):
+    column, separator, answer = value.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Filters are written COLUMN=ANSWER, got {value}")
+    return column, answer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the free-text answers through a persisted inverted index")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("query", choices=["build", "top", "search"])
+    parser.add_argument("term", nargs="?", help="term to search for")
+    parser.add_argument("--column", default=None, help="free-text column (default: all of them)")
+    parser.add_argument("--filter", type=parse_filter, action="append", default=[], metavar="COLUMN=ANSWER",
+                        help="only respondents with this answer, can be repeated")
+    parser.add_argument("--top", type=int, default=20, help="terms or notes shown")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file_path):
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+    filters = tuple(args.filter)
+
+    try:
+        if args.query == "build":
+            index = open_index(args.file_path, rebuild=True)
+            print(f"Indexed {len(index['rows'])} notes with {len(index['terms'])} distinct terms")
+        elif args.query == "top":
+            terms = top_terms(args.file_path, args.column, filters, args.top)
+            print(pd.DataFrame(terms, columns=["Term", "Notes"]).to_string(index=False))
+        else:
+            if not args.term:
+                parser.error("search needs a term")
+            hits = search(args.file_path, args.term, args.column, filters)
+            data = load_survey(args.file_path, [SUBMISSION_ID] + sorted({column for _, column in hits}))
+            print(f"{len(hits)} notes mention '{args.term}'")
+            for row, column in hits[:args.top]:
+                print(f"{data[SUBMISSION_ID].iloc[row]}  {column}: {data[column].iloc[row]}")
+    except KeyError as error:
+        print(f"Error: {error.args[0]}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from loader import load_survey, AGE
+from profiling import profiled
+
+# Approximate margins of the US adult population (Census ACS), as shares of the listed answers.
+# Answers not listed (e.g. "<18 years old", "Non-binary") and missing answers keep their observed share,
+# the listed targets are rescaled to the rest.
+DEFAULT_TARGETS = {
+    AGE: {
+        "18-24 years old": 0.12, "25-34 years old": 0.18, "35-44 years old": 0.17,
+        "45-54 years old": 0.16, "55-64 years old": 0.17, ">65 years old": 0.20,
+    },
+    "Gender": {"Male": 0.49, "Female": 0.51},
+    "Education Level": {
+        "Less than high school": 0.09, "High school graduate": 0.28, "Some college or associate's degree": 0.26,
+        "Bachelor's degree": 0.23, "Master's degree": 0.10, "Doctorate or professional degree": 0.04,
+    },
+}
+
+COLUMNS = list(DEFAULT_TARGETS)
+
+MAX_ITERATIONS = 100
+
+# Weights are trimmed to [1 / WEIGHT_CAP, WEIGHT_CAP] times the mean and raked again, up to TRIM_ROUNDS times,
+# which keeps the margins close to the targets with fewer extreme weights. A final trim without raking then
+# enforces the bounds, so a handful of respondents in rare cells cannot dominate the weighted results; where
+# the targets need more weight than that, the weighted margins stay short of them (see margins_table).
+WEIGHT_CAP = 5.0
+TRIM_ROUNDS = 10
+
+# Largest difference between a weighted margin share and its target once raking has converged
+TOLERANCE = 1e-8
+
+
+def dimension_codes(series):
+    # Answer codes of one weighting column with missing answers as an extra last level, and the answer labels
+    values = series.astype("category")
+    codes = values.cat.codes.to_numpy(dtype=np.int64)
+    levels = list(values.cat.categories)
+    return np.where(codes >= 0, codes, len(levels)), levels
+
+
+def target_shares(codes, levels, targets):
+    # Target share of every level (missing last): listed answers share what the unlisted ones leave.
+    # A target on an answer nobody gave cannot be reached, so it is dropped and the other targets rescaled.
+    observed = np.bincount(codes, minlength=len(levels) + 1) / len(codes)
+    listed = np.array([level in targets for level in levels] + [False]) & (observed > 0)
+    wanted = np.array([targets.get(level, 0.0) for level in levels] + [0.0])
+    shares = observed.copy()
+    if wanted[listed].sum() > 0:
+        shares[listed] = wanted[listed] / wanted[listed].sum() * (1 - observed[~listed].sum())
+    return shares
+
+
+def trim(unit_weights, counts, cap, max_iterations=MAX_ITERATIONS):
+    # Clip per-respondent weights (of cells holding counts respondents) to [mean / cap, cap * mean]. Clipping
+    # moves the mean, so it is repeated with the new mean until the bounds hold. Weights are clipped a hair
+    # inside the bounds so they still hold once the weights are rescaled to mean 1.
+    margin = 1e-9
+    for _ in range(max_iterations):
+        mean = (unit_weights * counts).sum() / counts.sum()
+        if unit_weights.max() <= cap * mean and unit_weights.min() >= mean / cap:
+            break
+        unit_weights = np.clip(unit_weights, mean / cap * (1 + margin), cap * mean * (1 - margin))
+    return unit_weights
+
+
+def rake(codes, shares, base=None, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    # Iterative proportional fitting: each pass scales the weights so one dimension's weighted margins match
+    # its target shares, with one bincount per dimension
+    weights = np.ones(len(codes[0])) if base is None else np.asarray(base, dtype=np.float64).copy()
+    total = weights.sum()
+    for _ in range(max_iterations):
+        for level_codes, level_shares in zip(codes, shares):
+            margins = np.bincount(level_codes, weights=weights, minlength=len(level_shares))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                factors = np.where(margins > 0, level_shares * total / margins, 1)
+            weights *= factors[level_codes]
+        error = max(np.abs(np.bincount(level_codes, weights=weights, minlength=len(level_shares)) / total
+                           - level_shares).max() for level_codes, level_shares in zip(codes, shares))
+        if error < tolerance:
+            break
+    return weights
+
+
+@profiled("weighting.weights")
+def survey_weights(data, targets=DEFAULT_TARGETS, cap=WEIGHT_CAP):
+    # Raking weights of every respondent, with mean 1. Respondents sharing an answer to every weighting column
+    # get the same weight, so the raking runs on the distinct answer combinations counted once, not on rows.
+    columns = [column for column in targets if column in data.columns]
+    if not columns or len(data) == 0:
+        return np.ones(len(data))
+    codes, shares, shape = [], [], []
+    for column in columns:
+        column_codes, levels = dimension_codes(data[column])
+        codes.append(column_codes)
+        shares.append(target_shares(column_codes, levels, targets[column]))
+        shape.append(len(levels) + 1)
+
+    cells, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse, minlength=len(cells))
+    cell_codes = list(np.unravel_index(cells, shape))
+    cell_weights = rake(cell_codes, shares, counts)
+    for _ in range(TRIM_ROUNDS if cap else 0):
+        trimmed = trim(cell_weights / counts, counts, cap) * counts
+        if np.allclose(trimmed, cell_weights):
+            break
+        cell_weights = rake(cell_codes, shares, trimmed)
+    unit_weights = cell_weights / counts
+    if cap:
+        unit_weights = trim(unit_weights, counts, cap)
+    weights = unit_weights[inverse]
+    weights = weights / weights.mean()
+    if cap and weights.max() > cap * weights.mean():
+        raise ValueError(f"Trimmed weights exceed {cap} times the mean")
+    return weights
+
+
+def effective_sample_size(weights):
+    # Number of equally weighted respondents giving estimates as precise as the weighted ones (Kish)
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights.sum() ** 2 / (weights ** 2).sum()
+
+
+def table_design_effect(weights, responses=None):
+    # What the chi-square statistic of a weighted table is divided by (first-order Rao-Scott): the table's total
+    # over its effective total. For weights with mean 1 this is the Kish design effect. With responses (the
+    # answers each respondent adds to a multi-response table) respondents are clusters of answers, and the
+    # effect is relative to the unweighted table, so equal weights always give 1.
+    weights = np.asarray(weights, dtype=np.float64)
+    responses = np.ones(len(weights)) if responses is None else np.asarray(responses, dtype=np.float64)
+    totals = weights * responses
+    return ((totals ** 2).sum() / totals.sum()) / ((responses ** 2).sum() / responses.sum())
+
+
+def margins_table(data, weights, targets=DEFAULT_TARGETS):
+    # Observed, weighted and target share of every answer to the weighting columns
+    rows = []
+    for column in targets:
+        codes, levels = dimension_codes(data[column])
+        observed = np.bincount(codes, minlength=len(levels) + 1) / len(codes)
+        weighted = np.bincount(codes, weights=weights, minlength=len(levels) + 1) / weights.sum()
+        shares = target_shares(codes, levels, targets[column])
+        for i, answer in enumerate(levels + ["(missing)"]):
+            rows.append({"Question": column, "Answer": answer, "Observed": observed[i], "Weighted": weighted[i],
+                         "Target": shares[i]})
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raking weights of the respondents against population margins")
+    parser.add_argument("file_path", help="path to the survey CSV")
+    parser.add_argument("--output", default=None, help="also save the weights per Submission ID to this CSV")
+    args = parser.parse_args()
+
+    try:
+        data = load_survey(args.file_path, ["Submission ID"] + COLUMNS)
+    except FileNotFoundError:
+        print(f"Error: File not found at {args.file_path}")
+        sys.exit(1)
+
+    weights = survey_weights(data)
+    print(margins_table(data, weights).to_string(index=False))
+    print(f"\nWeights from {weights.min():.3f} to {weights.max():.3f}, "
+          f"effective sample size {effective_sample_size(weights):.0f} of {len(weights)}")
+    if args.output:
+        pd.DataFrame({"Submission ID": data["Submission ID"], "Weight": weights}).to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()